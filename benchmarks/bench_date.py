@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Benchmark the date plugin against a plain dateparser search, on the
+text of a long statement
+
+Usage, from the root of the repository:
+
+    python -m benchmarks.bench_date [pages]
+"""
+import sys
+import random
+import datetime
+import time
+import dateparser.search
+from papier.document import normalized
+from papier.plugin import date
+
+
+def page(rng: random.Random, n: int) -> str:
+    words = ['statement', 'total', 'amount', 'balance', 'EUR', 'ACME',
+             'GmbH', 'Berlin', 'transfer', 'card', 'payment', 'ref']
+    lines = [f'ACME Bank - account 12345678 - page {n}']
+    if n == 1:
+        lines.append('Statement of 12 March 2023')
+    for _ in range(40):
+        amount = f'{rng.randint(1, 9999)}.{rng.randint(0, 99):02d}'
+        line = ' '.join(rng.choice(words) for _ in range(rng.randint(2, 8)))
+        lines.append(f'{line} {amount}.')
+    return '\n'.join(lines)
+
+
+def reference(text: str, lang: str, ref: datetime.datetime
+              ) -> datetime.datetime | None:
+    """What the plugin used to do: search the whole text"""
+    found = dateparser.search.search_dates(text, languages=[lang],
+                                           settings=date.SETTINGS) or []
+    dates = [d for _, d in found if d <= ref]
+    return dates[0] if dates else None
+
+
+def main() -> None:
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rng = random.Random(0)
+    text = normalized(page(rng, n) for n in range(1, pages + 1))
+    ref = datetime.datetime.now()
+    for name, func in (('dateparser', reference),
+                       ('plugin', date.first_date),
+                       ('plugin, memoized', date.first_date)):
+        start = time.perf_counter()
+        res = func(text, 'en', ref)
+        t = time.perf_counter() - start
+        print(f'{pages} pages, {len(text)} chars, {name}: '
+              f'{t * 1000:.1f} ms ({res})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""Benchmark papier.document.normalized on the text of a large document
+
+Usage, from the root of the repository:
+
+    python -m benchmarks.bench_normalized [pages]
+"""
+import sys
+import random
+import timeit
+from papier.document import normalized
+
+
+def page(rng: random.Random) -> str:
+    words = ['invoice', 'total', 'amount', 'due', '12.03.2023', 'EUR',
+             'ACME', 'GmbH', 'Berlin', '-', ',', ':', '']
+    lines = []
+    for _ in range(50):
+        line = ' '.join(rng.choice(words) for _ in range(rng.randint(0, 12)))
+        lines.append(rng.choice(['', '  ', '\t']) + line)
+    return '\n'.join(lines)
+
+
+def main() -> None:
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    rng = random.Random(0)
+    text = [page(rng) for _ in range(pages)]
+    joined = ''.join(text)
+    n = 10
+    for name, stmt in (('text', lambda: normalized(joined)),
+                       ('pages', lambda: normalized(iter(text)))):
+        t = timeit.timeit(stmt, number=n) / n
+        print(f'{pages} pages, {len(joined)} chars, {name}: '
+              f'{t * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""Benchmark the startup of the command line: the time to run commands
+which do little work, in a new process every time. The plugin manifest
+is written by a first run, as it would be after an install
+
+Usage, from the root of the repository:
+
+    python -m benchmarks.bench_startup [runs]
+"""
+import os
+import sys
+import statistics
+import subprocess
+import tempfile
+import time
+
+COMMANDS = [['--help'], ['list'], ['search', 'invoice']]
+
+
+def run(args: list[str], env: dict[str, str]) -> float:
+    """returns how long papiers took to run the command, in seconds"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, 'papiers'] + args, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'config.yaml'), 'w') as f:
+            f.write(f'library: {tmp}/library.sqlite\n'
+                    f'log: {tmp}/papier.log\n'
+                    f'plugin_manifest: {tmp}/manifest.json\n')
+        env = dict(os.environ, PAPIERDIR=tmp)
+        # Write the manifest and the library
+        run(['--help'], env)
+        for args in COMMANDS:
+            times = [run(args, env) for _ in range(runs)]
+            print(f'papiers {" ".join(args)}: '
+                  f'median {statistics.median(times) * 1000:.0f} ms, '
+                  f'min {min(times) * 1000:.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
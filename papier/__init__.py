@@ -1,21 +1,32 @@
 """Basic papier info. Imported before the command line gets parsed"""
 import confuse
+from typing import Any
 from .extractor import extracts, extractors
-from .document import Document
+from .tags import TagValue
 from .errors import PapierError, ConfigError, CommandError, PluginError
 from .plugins import (load_plugins, declare_event, set_event_handler,
                       send_event)
 
 
-__all__ = ['extracts', 'extractors', 'Document', 'PapierError',
-           'ConfigError', 'CommandError', 'PluginError', 'load_plugins',
-           'declare_event', 'set_event_handler', 'send_event']
+__all__ = ['extracts', 'extractors', 'Document', 'Budget', 'TagValue',
+           'PapierError', 'ConfigError', 'CommandError', 'PluginError',
+           'load_plugins', 'declare_event', 'set_event_handler',
+           'send_event']
 __version__ = '0.0.1'
 __author__ = 'Christophe-Marie Duquesne <chmd+papier@chmd.fr>'
 
 
 # Plugins which should always be loaded first
-core_plugins = ['importer', 'info', 'organize', 'set_tags']
+core_plugins = ['importer', 'info', 'organize', 'search', 'set_tags',
+                'watch']
+
+
+def __getattr__(name: str) -> Any:
+    # Parsing pdfs needs heavy modules: only import them when needed
+    if name in ('Document', 'Budget'):
+        from . import document
+        return getattr(document, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 config = confuse.Configuration('papier', __name__)
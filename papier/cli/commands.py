@@ -3,13 +3,14 @@ import papier.plugins
 import argparse
 import argcomplete
 import logging
+import os
 import sys
 from typing import Any, Callable, Tuple, List, Dict
 
 
 papier.declare_event('subcommand_end',
                      'called after a subcommand finishes. Argument: '
-                     '`command`, the name of the subcommand')
+                     '`command`, the name of the subcommand', __name__)
 
 
 # Parser
@@ -63,10 +64,16 @@ def command(*added_arguments: Any, command_name: str = None) -> Callable:
                     f'{name} is already defined by {_command_module[name]}'
                     )
         _command_module[name] = func.__module__
-
-        parser = subparsers.add_parser(name,
-                                       description=func.__doc__,
-                                       help=func.__doc__)
+        papier.plugins.provide(func.__module__, 'commands', name,
+                               func.__doc__)
+
+        # The parser may already be there, announced by the manifest
+        if name in subparsers.choices:
+            parser = subparsers.choices[name]
+        else:
+            parser = subparsers.add_parser(name,
+                                           description=func.__doc__,
+                                           help=func.__doc__)
         for args, kwds in added_arguments:
             # Hack to pass a argcomplete.completer:
             #
@@ -102,6 +109,41 @@ def add_argument(*names_or_flags: Any, **kwds: Any
     return names_or_flags, kwds
 
 
+def announce_commands() -> dict[str, str]:
+    """Add a parser for each command of the available plugins, without
+    importing them. Returns the plugin defining each command"""
+    res = {}
+    for plugin, name, help in papier.plugins.commands():
+        module = f'papier.plugin.{plugin}'
+        defined_by = res.get(name) or _command_module.get(name, module)
+        if defined_by not in (plugin, module):
+            raise papier.PluginError(
+                    f'{name} is already defined by {defined_by}')
+        res[name] = plugin
+        if name not in subparsers.choices:
+            subparsers.add_parser(name, description=help, help=help)
+    return res
+
+
+def invoked_command(argv: list[str]) -> str | None:
+    """returns the command the arguments invoke, if any. When completing
+    the command line, the arguments are read from argcomplete's
+    environment, and the word being completed is ignored"""
+    if '_ARGCOMPLETE' in os.environ:
+        line = os.environ.get('COMP_LINE', '')
+        line = line[:int(os.environ.get('COMP_POINT', len(line)))]
+        argv = line.split()[1:]
+        if not line.endswith(' ') and argv:
+            argv = argv[:-1]
+    for arg in argv:
+        if arg in subparsers.choices:
+            return arg
+        # Global flags do not take values
+        if not arg.startswith('-'):
+            return None
+    return None
+
+
 # Main entry point
 def main() -> None:
     # Start logging before we even parse the command line
@@ -116,10 +158,15 @@ def main() -> None:
         )
     logging.captureWarnings(True)
 
-    # Load the plugins so that we know what commands must be parsed
+    # Find out what commands the plugins define, and only import the
+    # plugin of the command to run
     # Core plugins first, user-specified second to avoid collisions
-    papier.plugins.load_plugins(papier.core_plugins)
-    papier.plugins.load_plugins(papier.config['plugins'].as_str_seq())
+    papier.plugins.scan_plugins(papier.core_plugins)
+    papier.plugins.scan_plugins(papier.config['plugins'].as_str_seq())
+    command_plugin = announce_commands()
+    name = invoked_command(sys.argv[1:])
+    if name in command_plugin:
+        papier.plugins.load_plugin(command_plugin[name])
 
     # Enable command line completion
     argcomplete.autocomplete(cli)
@@ -1,52 +1,219 @@
 import papier
-from typing import Self, List, Dict, Any
-import pypdf
+import papier.ocrcache as ocrcache
+from typing import (Self, List, Dict, Any, NamedTuple, Iterable, Iterator,
+                    TYPE_CHECKING)
 import tempfile
 import os
 import os.path
-import shutil
-import ocrmypdf
+import mmap
 import hashlib
 import re
+import threading
 from dataclasses import dataclass, field
 
+# pypdf and ocrmypdf are slow to import: only when a file is read
+if TYPE_CHECKING:
+    import pypdf
 
-def normalized(text: str) -> str:
-    """Normalize text."""
-    res = ''
-    lines = text.split('\n')
-    for line in lines:
+
+# Runs of whitespace within a line
+_SPACES = re.compile(r'\s+')
+
+# Characters after which a line continues on the next one
+_CONTINUED = re.compile(r'[\w\d,\-]')
+
+
+def _lines(chunks: Iterable[str]) -> Iterator[str]:
+    """Splits the concatenation of the chunks into lines"""
+    pending = []
+    for chunk in chunks:
+        lines = chunk.split('\n')
+        if len(lines) == 1:
+            pending.append(chunk)
+            continue
+        pending.append(lines[0])
+        yield ''.join(pending)
+        yield from lines[1:-1]
+        pending = [lines[-1]]
+    yield ''.join(pending)
+
+
+def normalized(text: str | Iterable[str]) -> str:
+    """Normalize text. The text can be given in chunks (for instance
+    pages), in which case the result is the same as for their
+    concatenation."""
+    if isinstance(text, str):
+        text = (text,)
+    res = []
+    for line in _lines(text):
         line = line.strip()
         # empty strings after stripping convert to newline character
         if not line:
-            line = '\n'
+            res.append('\n')
+            continue
+        res.append(_SPACES.sub(' ', line))
+        # if the last character is not a letter or a number, add
+        # newline character to a line
+        if _CONTINUED.match(line[-1]):
+            res.append(' ')
         else:
-            line = re.sub(r'\s+', ' ', line)
-            # if the last character is not a letter or a number, add
-            # newline character to a line
-            if not re.search(r'[\w\d,\-]', line[-1]):
-                line += '\n'
-            else:
-                line += ' '
-        res += line
-    res = res.strip()
-    return res
+            res.append('\n')
+    return ''.join(res).strip()
+
+
+def ocred(path: str, ocr: Any) -> str:
+    """Process path according to the ocr mode. Returns the name of the
+    resulting file: path itself if it needs no processing, otherwise a
+    temporary file which the caller is responsible for"""
+    match ocr:
+        case 'no' | False:
+            return path
+        case 'force' | 'yes' | True:
+            pass
+        case _:
+            raise papier.ConfigError(
+                    f'ocr={ocr}: unexpected config value"')
+    import ocrmypdf
+    tmpfile = tempfile.NamedTemporaryFile(delete=False).name
+    try:
+        ocrmypdf.ocr(path, tmpfile, force_ocr=(ocr == 'force'),
+                     progress_bar=False)
+    except ocrmypdf.exceptions.PriorOcrFoundError:
+        os.remove(tmpfile)
+        return path
+    except BaseException:
+        os.remove(tmpfile)
+        raise
+    return tmpfile
+
+
+class Span(NamedTuple):
+    """A non blank piece of text of a page, normalized, with its font"""
+    text: str
+    font: str
+    size: float
+    bold: bool
+
+
+@dataclass(slots=True)
+class Page():
+    """A page of a Document. Its text and its layout are extracted
+    together, in a single pass, on first access. The pages of a document
+    share its lock, since they read from the same file"""
+    page: 'pypdf.PageObject' = field(repr=False)
+    raw_: str = field(default=None, repr=False)
+    spans_: List[Span] = field(default=None, repr=False)
+    text_: str = field(default=None, init=False, repr=False)
+    lock_: threading.RLock = field(default_factory=threading.RLock,
+                                   repr=False)
+
+    def extract(self: Self) -> None:
+        with self.lock_:
+            if self.raw_ is None or self.spans_ is None:
+                self._extract()
+
+    def _extract(self: Self) -> None:
+        spans = []
+
+        def visit(text: str, cm: List[float], tm: List[float],
+                  font_dict: Dict[str, Any], font_size: float) -> None:
+            text = normalized(text)
+            # We are only interested in non blank parts
+            if text.strip() == '':
+                return
+            font = ''
+            if font_dict:
+                if '/BaseFont' in font_dict:
+                    font = str(font_dict['/BaseFont'])
+            spans.append(Span(text, font, float(font_size),
+                              'bold' in font.lower()))
+
+        self.raw_ = self.page.extract_text(visitor_text=visit)
+        self.spans_ = spans
+
+    @property
+    def raw(self: Self) -> str:
+        """text of the page, as extracted"""
+        if self.raw_ is None:
+            self.extract()
+        return self.raw_
 
+    @property
+    def spans(self: Self) -> List[Span]:
+        """pieces of text of the page, in reading order"""
+        if self.spans_ is None:
+            self.extract()
+        return self.spans_
 
-@dataclass
+    @property
+    def text(self: Self) -> str:
+        """normalized text of the page"""
+        if self.text_ is None:
+            self.text_ = normalized(self.raw)
+        return self.text_
+
+
+@dataclass(slots=True)
 class Document():
+    """A pdf file. The expensive work (OCR, parsing, text extraction) is
+    only done when pdfreader, pages, text or tmpfile are first accessed,
+    so that creating a Document is cheap. Page texts are extracted one by
+    one, as needed.
+
+    Until then, or once closed, a Document is a mere handle: a path, and
+    possibly a checksum and a mtime. Use it as a context manager, or call
+    close(), to release the parsed content and the temporary file as soon
+    as they are not needed anymore.
+
+    Extractors may read a Document from several threads: loading and
+    text extraction hold lock_, and so should any other use of
+    pdfreader."""
     path: str
-    pdfreader: pypdf.PdfReader = field(default=None, init=False,
-                                       repr=False)
-    text: str = field(default="", init=False, repr=False)
-    tmpfile: str = field(default="", init=False)
+    ocr: Any = field(default=None, repr=False)
+    pdfreader_: 'pypdf.PdfReader' = field(default=None, init=False,
+                                          repr=False)
+    pages_: List[Page] = field(default=None, init=False, repr=False)
+    extracted_: List[tuple[str, List[Span]]] = field(default=None,
+                                                     init=False, repr=False)
+    text_: str = field(default=None, init=False, repr=False)
+    mmap_: mmap.mmap = field(default=None, init=False, repr=False)
+    tmpfile_: str = field(default="", init=False)
+    owned_: bool = field(default=False, init=False, repr=False)
     sha256sum_: str = field(default="", init=False)
+    mtime_: float = field(default=None, init=False, repr=False)
+    cache_key_: str = field(default=None, init=False, repr=False)
+    lock_: threading.RLock = field(default_factory=threading.RLock,
+                                   init=False, repr=False)
 
     def __del__(self: Self) -> None:
         """Clean-up after ourselves"""
-        if self.tmpfile != '':
-            if os.path.exists(self.tmpfile):
-                os.remove(self.tmpfile)
+        self.close()
+
+    def __enter__(self: Self) -> Self:
+        return self
+
+    def __exit__(self: Self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self: Self) -> None:
+        """Release the parsed content and delete the temporary file. The
+        content is parsed again if accessed afterwards"""
+        self.pdfreader_ = None
+        self.pages_ = None
+        self.extracted_ = None
+        self.text_ = None
+        if self.mmap_ is not None:
+            try:
+                self.mmap_.close()
+            except BufferError:
+                # Still referenced somewhere, let the GC handle it
+                pass
+            self.mmap_ = None
+        if self.owned_:
+            if os.path.exists(self.tmpfile_):
+                os.remove(self.tmpfile_)
+        self.tmpfile_ = ''
+        self.owned_ = False
 
     def sha256sum(self: Self) -> str:
         if self.sha256sum_ == '':
@@ -54,80 +221,225 @@ class Document():
                 self.sha256sum_ = hashlib.file_digest(f, 'sha256').hexdigest()
         return self.sha256sum_
 
+    def load(self: Self) -> None:
+        """Run OCR and parse the result, unless already done. If not
+        given at creation, the ocr mode is read from the config"""
+        if self.pdfreader_ is not None:
+            return
+        with self.lock_:
+            if self.pdfreader_ is None:
+                self._load()
+
+    def _load(self: Self) -> None:
+        if self.tmpfile_ == '':
+            ocr = self.ocr
+            if ocr is None:
+                ocr = papier.config['import']['ocr'].get()
+            self.cache_key_ = ocrcache.key(self.sha256sum(), ocr)
+            cached = None
+            if self.cache_key_ is not None:
+                cached = ocrcache.checkout(self.cache_key_)
+            if cached is not None:
+                self.tmpfile_ = cached
+            else:
+                self.tmpfile_ = ocred(self.path, ocr)
+                # No need to cache files that were not processed
+                unchanged = (self.tmpfile_ == self.path)
+                if self.cache_key_ is not None and not unchanged:
+                    ocrcache.put(self.cache_key_, self.tmpfile_)
+            self.owned_ = (self.tmpfile_ != self.path)
+        with open(self.tmpfile_, 'rb') as f:
+            try:
+                self.mmap_ = mmap.mmap(f.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped, let pypdf report them
+                pass
+        import pypdf
+        if self.mmap_ is None:
+            self.pdfreader_ = pypdf.PdfReader(self.tmpfile_)
+        else:
+            self.pdfreader_ = pypdf.PdfReader(self.mmap_)
+
+    def owns_tmpfile(self: Self) -> bool:
+        """Whether tmpfile is a private file, deleted on close, rather
+        than the original file itself"""
+        return self.owned_
+
+    @property
+    def pdfreader(self: Self) -> 'pypdf.PdfReader':
+        self.load()
+        return self.pdfreader_
+
+    @property
+    def tmpfile(self: Self) -> str:
+        """file holding the processed pdf. It is path itself when no
+        processing was needed"""
+        self.load()
+        return self.tmpfile_
+
+    @property
+    def pages(self: Self) -> List[Page]:
+        if self.pages_ is not None:
+            return self.pages_
+        with self.lock_:
+            if self.pages_ is None:
+                self.load()
+                extracted = self.extracted_
+                if extracted is None and self.cache_key_ is not None:
+                    extracted = ocrcache.get_pages(self.cache_key_)
+                pages = self.pdfreader.pages
+                if extracted is None or len(extracted) != len(pages):
+                    extracted = [(None, None)] * len(pages)
+                res = []
+                for page, (raw, spans) in zip(pages, extracted):
+                    if spans is not None:
+                        spans = [Span(*span) for span in spans]
+                    res.append(Page(page, raw, spans, self.lock_))
+                self.pages_ = res
+                self.extracted_ = None
+            return self.pages_
+
+    def extracted(self: Self) -> List[tuple[str, List[Span]]]:
+        """returns the text and the spans of every page, extracting them
+        if necessary"""
+        cached = all(p.spans_ is not None for p in self.pages)
+        res = [(p.raw, p.spans) for p in self.pages]
+        if not cached and self.cache_key_ is not None:
+            ocrcache.put_pages(self.cache_key_, res)
+        return res
+
+    @property
+    def text(self: Self) -> str:
+        """normalized text of the whole document"""
+        if self.text_ is None:
+            with self.lock_:
+                if self.text_ is None:
+                    self.text_ = normalized(
+                            raw for raw, _ in self.extracted())
+        return self.text_
+
     @classmethod
-    def from_library(cls: Self, path: str, sha256sum: str) -> Self:
-        """TODO Create a document from a library entry"""
+    def from_library(cls: Self, path: str, sha256sum: str,
+                     mtime: float = None) -> Self:
+        """Create a handle on a library entry. Nothing is read until the
+        content is needed"""
         res = cls.from_import(path)
         res.sha256sum_ = sha256sum
+        res.mtime_ = mtime
         return res
 
     @classmethod
-    def from_import(cls: Self, path: str) -> Self:
-        """Create a Document from a file to import"""
+    def from_import(cls: Self, path: str, ocr: Any = None) -> Self:
+        """Create a Document from a file to import. Nothing is done until
+        the content is needed"""
+        return cls(path, ocr)
+
+    @classmethod
+    def from_tmpfile(cls: Self, path: str, tmpfile: str,
+                     extracted: List[tuple[str, List[Span]]] = None
+                     ) -> Self:
+        """Create a Document from a file to import, for which ocred() was
+        already called. The Document takes ownership of tmpfile, unless
+        it is path itself. The text
+        and spans of the pages can be provided if already extracted"""
         res = cls(path)
+        res.tmpfile_ = tmpfile
+        res.owned_ = (tmpfile != path)
+        res.extracted_ = extracted
+        return res
 
-        tmpfile = tempfile.NamedTemporaryFile(delete=False).name
-        ocr = papier.config['import']['ocr'].get()
-        match ocr:
-            case 'no' | False:
-                shutil.copy(path, tmpfile)
-            case 'force':
-                ocrmypdf.ocr(path, tmpfile, force_ocr=True,
-                             progress_bar=False)
-            case 'yes' | True:
-                try:
-                    ocrmypdf.ocr(path, tmpfile, progress_bar=False)
-                except ocrmypdf.exceptions.PriorOcrFoundError:
-                    shutil.copy(path, tmpfile)
-            case _:
-                raise papier.ConfigError(
-                        f'ocr={ocr}: unexpected config value"')
-        res.tmpfile = tmpfile
-
-        res.pdfreader = pypdf.PdfReader(tmpfile)
-
-        text = ''
-        for p in res.pdfreader.pages:
-            text += p.extract_text()
-        res.text = normalized(text)
+    def important_parts(self: Self) -> List[str]:
+        """return the important parts of the document"""
+        return important_parts(self.pages)
 
-        return res
+    def mtime(self: Self) -> float:
+        if self.mtime_ is not None:
+            return self.mtime_
+        return os.path.getmtime(self.path)
 
-    def _parts(self: Self, bold: bool = False, by_size: bool = False
-               ) -> List[str]:
-        """return parts of the documents"""
-        parts = []
+    def size(self: Self) -> int:
+        return os.path.getsize(self.path)
 
-        def visit(text: str, cm: List[float], tm: List[float],
-                  font_dict: Dict[str, Any], font_size: float) -> None:
-            text = normalized(text)
-            # We are only interested in non blank parts
-            if text.strip() == '':
-                return
-            part = [text, font_size]
-            if bold:
-                if font_dict:
-                    if '/BaseFont' in font_dict:
-                        if 'bold' in font_dict['/BaseFont'].lower():
-                            parts.append(part)
-            else:
-                parts.append(part)
 
-        # If no subset of page numbers was provided, we visit all of them
-        for page in self.pdfreader.pages:
-            page.extract_text(visitor_text=visit)
-        # Sort if necessary
-        if by_size:
-            parts.sort(key=lambda x: x[1], reverse=True)
+def _parts(pages: List[Page], bold: bool = False, by_size: bool = False
+           ) -> List[str]:
+    """return parts of the pages"""
+    parts = [span for page in pages for span in page.spans
+             if span.bold or not bold]
+    # Sort if necessary
+    if by_size:
+        parts.sort(key=lambda x: x.size, reverse=True)
 
-        return [part[0] for part in parts]
+    return [part.text for part in parts]
 
-    def important_parts(self: Self) -> List[str]:
-        """return the important parts of the document"""
-        important = self._parts(bold=True, by_size=True)
-        if important == []:
-            important = self._parts(by_size=True)
-        return important
 
-    def mtime(self: Self) -> float:
-        return os.path.getmtime(self.path)
+def important_parts(pages: List[Page]) -> List[str]:
+    """return the important parts of the pages, largest first"""
+    important = _parts(pages, bold=True, by_size=True)
+    if important == []:
+        important = _parts(pages, by_size=True)
+    return important
+
+
+def sampled(text: str, head: int = 0, tail: int = 0) -> str:
+    """returns the first head and the last tail characters of text,
+    joined by a newline (0: no limit)"""
+    if (not head and not tail) or head + tail >= len(text):
+        return text
+    if not tail:
+        return text[:head]
+    return text[:head] + '\n' + text[len(text) - tail:]
+
+
+@dataclass(frozen=True)
+class Budget():
+    """How much of a document an extractor reads: the first pages, and
+    of their text the first chars and the last tail characters. With
+    parts, the text is made of the important parts only. 0 means no
+    limit"""
+    pages: int = 0
+    chars: int = 0
+    tail: int = 0
+    parts: bool = False
+
+
+class View():
+    """A Document restricted to a Budget. pages, text and
+    important_parts() only cover what the budget allows, everything else
+    comes from the document"""
+    __slots__ = ('document', 'budget', 'text_')
+
+    def __init__(self: Self, document: Document, budget: Budget) -> None:
+        self.document = document
+        self.budget = budget
+        self.text_ = None
+
+    def __getattr__(self: Self, name: str) -> Any:
+        return getattr(self.document, name)
+
+    def __repr__(self: Self) -> str:
+        return f'View({self.document!r}, {self.budget!r})'
+
+    @property
+    def pages(self: Self) -> List[Page]:
+        if self.budget.pages:
+            return self.document.pages[:self.budget.pages]
+        return self.document.pages
+
+    @property
+    def text(self: Self) -> str:
+        if self.text_ is None:
+            if self.budget.parts:
+                text = '\n'.join(self.important_parts())
+            elif self.budget.pages:
+                text = normalized(page.raw for page in self.pages)
+            else:
+                text = self.document.text
+            self.text_ = sampled(text, self.budget.chars, self.budget.tail)
+        return self.text_
+
+    def important_parts(self: Self) -> List[str]:
+        if self.budget.pages:
+            return important_parts(self.pages)
+        return self.document.important_parts()
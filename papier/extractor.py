@@ -1,52 +1,212 @@
 import papier
-from typing import Self, Any, Callable
+from typing import Self, Any, Callable, Iterable, Iterator
 import collections
+import concurrent.futures
+import confuse
+import hashlib
+import heapq
+import json
+import logging
+import sys
 from dataclasses import dataclass, field
 import functools
+from itertools import compress
+
+
+# Logger for this module
+log = logging.getLogger(__name__)
 
 
 @dataclass
 class Extractor():
     """Extracts information from a document, possibly leveraging the
-    result of previous extractors"""
+    result of previous extractors. A batch extractor processes a list of
+    (document, tags) pairs at once, and returns the list of results.
+
+    With a budget, the extractor only gets a view of the documents
+    restricted to it, so that its cost does not grow with their length.
+
+    The results of an extractor only depend on the document, its code,
+    the config sections it reads (config, by default the one named after
+    its plugin) and the tags it consumes, so that they can be cached"""
     extract: Callable = field(repr=False)
     plugin: str = field(default='', init=False)
     consumes: list[str]
     produces: list[str]
+    batch: bool = False
+    budget: 'papier.Budget' = None
+    config: list[str] = None
 
     def __post_init__(self: Self) -> None:
         self.plugin = self.extract.__module__.split('.')[-1]
+        if self.config is None:
+            self.config = [self.plugin]
+
+    @property
+    def name(self: Self) -> str:
+        return f'{self.plugin}.{self.extract.__name__}'
+
+    @functools.cached_property
+    def version(self: Self) -> str | None:
+        """returns the checksum of the module of the extractor, or None
+        if it cannot be read"""
+        module = sys.modules.get(self.extract.__module__)
+        try:
+            with open(module.__file__, 'rb') as f:
+                return hashlib.file_digest(f, 'sha256').hexdigest()
+        except (AttributeError, TypeError, OSError):
+            return None
+
+    def settings(self: Self) -> str:
+        """returns the checksum of the config the extractor depends on:
+        its config sections, and the OCR mode for the text it reads"""
+        conf = {}
+        for path in self.config + ['import.ocr']:
+            view = papier.config
+            for key in path.split('.'):
+                view = view[key]
+            try:
+                conf[path] = view.get()
+            except confuse.ConfigError:
+                conf[path] = None
+        return checksum(conf)
+
+    def inputs(self: Self, tags: dict[str, Any]) -> str:
+        """returns the checksum of the tags the extractor consumes"""
+        return checksum({tag: tags.get(tag) for tag in self.consumes})
 
+    def view(self: Self, document: 'papier.Document') -> Any:
+        """returns what the extractor gets to read from document"""
+        if self.budget is None:
+            return document
+        return papier.document.View(document, self.budget)
 
-# List of registered extractors
+    def extract_one(self: Self, document: 'papier.Document',
+                    tags: dict[str, Any]
+                    ) -> tuple[dict[str, Any], dict[str, Any]]:
+        if self.batch:
+            return self.extract([(self.view(document), tags)])[0]
+        return self.extract(self.view(document), tags)
+
+    def extract_many(self: Self,
+                     pairs: list[tuple['papier.Document', dict[str, Any]]]
+                     ) -> list[tuple[dict[str, Any], dict[str, Any]]]:
+        pairs = [(self.view(document), tags) for document, tags in pairs]
+        if self.batch:
+            return self.extract(pairs)
+        return [self.extract(document, tags) for document, tags in pairs]
+
+
+def checksum(data: Any) -> str:
+    """returns the checksum of data, once serialized to json"""
+    dump = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(dump.encode()).hexdigest()
+
+
+# Registered extractors, in an order where every extractor comes after
+# the producers of the tags it consumes
 extractors: list[Extractor] = []
 
+# Registered extractors, in registration order
+_registered: list[Extractor] = []
+
 # Map plugins to the tags they extract
 plugins = collections.defaultdict(list)
 
 
-def unsatisfied(extractors: list[Extractor]) -> int:
-    """unsatisfied dependencies if the extractors are processed in order"""
-    produced: set[str] = set()
-    res = 0
+def dependencies(extractors: list[Extractor]) -> list[set[int]]:
+    """returns, for each extractor, the indices of the extractors
+    producing the tags it consumes. The extractors which may produce any
+    tag (they do not declare what they produce) and need none come
+    before the others, which may then be skipped"""
+    producers = collections.defaultdict(set)
+    for i, e in enumerate(extractors):
+        for tag in e.produces:
+            producers[tag].add(i)
+    first = {i for i, e in enumerate(extractors)
+             if not e.produces and not e.consumes}
+    return [set().union(*(producers[tag] for tag in e.consumes),
+                        first if e.produces else ()) - {i}
+            for i, e in enumerate(extractors)]
+
+
+def ancestors(extractors: list[Extractor]) -> list[set[int]]:
+    """returns, for each extractor, the indices of the extractors it
+    depends on, directly or not: they are done before it starts"""
+    res = [set(d) for d in dependencies(extractors)]
+    changed = True
+    while changed:
+        changed = False
+        for d in res:
+            indirect = set().union(*(res[j] for j in d)) - d
+            if indirect:
+                d |= indirect
+                changed = True
+    return res
+
+
+def ordered(extractors: list[Extractor]
+            ) -> tuple[list[Extractor], list[Extractor]]:
+    """Sort the extractors topologically, keeping their order otherwise.
+    returns the sorted extractors, and the ones left out because they
+    are part of a cycle (or depend on one)"""
+    deps = dependencies(extractors)
+    dependents = collections.defaultdict(list)
+    for i, d in enumerate(deps):
+        for j in d:
+            dependents[j].append(i)
+    waiting = [len(d) for d in deps]
+    ready = [i for i, n in enumerate(waiting) if n == 0]
+    heapq.heapify(ready)
+    res = []
+    while ready:
+        i = heapq.heappop(ready)
+        res.append(extractors[i])
+        for j in dependents[i]:
+            waiting[j] -= 1
+            if waiting[j] == 0:
+                heapq.heappush(ready, j)
+    left = [e for i, e in enumerate(extractors) if waiting[i] > 0]
+    return res, left
+
+
+def check(extractors: list[Extractor] = extractors) -> None:
+    """Report the tags consumed but never produced, and raise a
+    PluginError if the extractors depend on each other in a cycle"""
+    produced = {tag for e in extractors for tag in e.produces}
     for e in extractors:
         for tag in e.consumes:
             if tag not in produced:
-                res += 1
-        for tag in e.produces:
-            produced.add(tag)
-    return res
+                log.warning(f'{e.plugin} consumes "{tag}", which no '
+                            'extractor produces')
+    _, left = ordered(extractors)
+    if left:
+        raise papier.PluginError(
+                'extractors depending on each other: '
+                f'{", ".join(e.plugin for e in left)}')
 
 
-def register_extractor(e: Extractor) -> None:
-    def score(i: int) -> int:
-        """Number of unsatisfied dependencies for the list where e is
-        inserted in the position i"""
-        return unsatisfied(extractors[:i] + [e] + extractors[i:])
+def needed(extractors: list[Extractor], tags: Iterable[str]
+           ) -> list[Extractor]:
+    """returns, in order, the extractors needed to produce tags: their
+    producers, the producers of the tags those consume, and so on. The
+    extractors which do not declare what they produce (e.g. reading the
+    tags stored in the file) are always needed"""
+    res = [not e.produces for e in extractors]
+    wanted = set(tags)
+    for e in compress(extractors, res):
+        wanted.update(e.consumes)
+    changed = True
+    while changed:
+        changed = False
+        for i, e in enumerate(extractors):
+            if not res[i] and wanted.intersection(e.produces):
+                res[i] = changed = True
+                wanted.update(e.consumes)
+    return list(compress(extractors, res))
 
-    # Index of insertion with the minimal score
-    index_min = min(range(len(extractors) + 1), key=score)
 
+def register_extractor(e: Extractor) -> None:
     # A plugin shall not register 2 extractors for the same tag
     plugin = e.plugin
     for tag in e.produces:
@@ -56,15 +216,62 @@ def register_extractor(e: Extractor) -> None:
             raise papier.PluginError(
                     f'{plugin} registers 2 extractors for "{tag}"')
 
-    extractors.insert(index_min, e)
+    _registered.append(e)
+    # Extractors in a cycle are kept last, until check() reports them
+    res, left = ordered(_registered)
+    extractors[:] = res + left
+    papier.plugins.provide(e.extract.__module__, 'extractors',
+                           {'produces': e.produces, 'consumes': e.consumes})
+
+
+def run(extractors: list[Extractor], start: Callable[[Extractor], Callable],
+        threads: int = 1) -> Iterator[tuple[Extractor, Any]]:
+    """Run the extractors on up to threads threads, each as soon as the
+    extractors it depends on are done. start(e) is called in the calling
+    thread when e is ready to run, and returns the function to run.
+    Yields (extractor, result) as they are done: the extractors depending
+    on e only start once the caller is done with its result"""
+    deps = dependencies(extractors)
+    dependents = collections.defaultdict(list)
+    for i, d in enumerate(deps):
+        for j in d:
+            dependents[j].append(i)
+    waiting = [len(d) for d in deps]
+    with concurrent.futures.ThreadPoolExecutor(max(threads, 1)) as pool:
+        running = {}
+
+        def submit(i: int) -> None:
+            running[pool.submit(start(extractors[i]))] = i
+
+        for i, n in enumerate(waiting):
+            if n == 0:
+                submit(i)
+        while running:
+            done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+            # Keep the order of the extractors among the ones done
+            for f in sorted(done, key=running.get):
+                i = running.pop(f)
+                yield extractors[i], f.result()
+                for j in dependents[i]:
+                    waiting[j] -= 1
+                    if waiting[j] == 0:
+                        submit(j)
 
 
-def extracts(produces: list[str] = [], consumes: list[str] = []) -> Callable:
-    """Register a function as an extractor, positioning it so that
-    unsatisfied dependencies are minimized"""
-    def decorator(func: Callable[[papier.Document, dict[str, Any]],
+def extracts(produces: list[str] = [], consumes: list[str] = [],
+             batch: bool = False, budget: 'papier.Budget' = None,
+             config: list[str] = None) -> Callable:
+    """Register a function as an extractor, to run once the tags it
+    consumes are produced. With batch, the function takes a list of
+    (document, tags) pairs and returns a list of results. With a budget
+    (a papier.Budget), the function only sees the part of the documents
+    the budget allows. config lists the config sections the function
+    reads (e.g. 'import.set'), if not the one named after its plugin"""
+    def decorator(func: Callable[['papier.Document', dict[str, Any]],
                                  dict[str, Any]]) -> Callable:
-        register_extractor(Extractor(func, consumes, produces))
+        register_extractor(Extractor(func, consumes, produces, batch,
+                                     budget, config))
 
         @functools.wraps
         def wrapper(*args: Any, **kwargs: Any) -> Any:
@@ -0,0 +1,70 @@
+"""Cheap file copies. Depending on what the filesystem supports, a copy
+is a reflink (copy on write), a hard link, or an in-kernel copy"""
+import os
+import shutil
+import fcntl
+import errno
+import logging
+
+
+# Logger for this module
+log = logging.getLogger(__name__)
+
+
+# From <linux/fs.h>: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+# Errors meaning that the operation is not possible for these files
+_UNSUPPORTED = (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL,
+                errno.ENOSYS, errno.EPERM, errno.EBADF)
+
+
+def _reflink(src: int, dst: int) -> bool:
+    try:
+        fcntl.ioctl(dst, FICLONE, src)
+        return True
+    except OSError as e:
+        if e.errno in _UNSUPPORTED:
+            return False
+        raise
+
+
+def _copy_file_range(src: int, dst: int) -> bool:
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    size = os.fstat(src).st_size
+    copied = 0
+    try:
+        while copied < size:
+            n = os.copy_file_range(src, dst, size - copied)
+            if n == 0:
+                break
+            copied += n
+    except OSError as e:
+        if e.errno in _UNSUPPORTED and copied == 0:
+            return False
+        raise
+    return True
+
+
+def clone(src: str, dst: str, link: bool = False) -> None:
+    """Copy src to dst. With link, dst may become a hard link to src, in
+    which case dst must not exist: only use it for private files that
+    nobody will modify in place."""
+    if link:
+        try:
+            os.link(src, dst)
+            log.debug(f'linked {src} to {dst}')
+            return
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED + (errno.EMLINK,):
+                raise
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if _reflink(fsrc.fileno(), fdst.fileno()):
+            log.debug(f'reflinked {src} to {dst}')
+        elif _copy_file_range(fsrc.fileno(), fdst.fileno()):
+            log.debug(f'copied {src} to {dst} in kernel')
+        else:
+            shutil.copyfileobj(fsrc, fdst)
+    shutil.copymode(src, dst)
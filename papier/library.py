@@ -1,9 +1,22 @@
+"""The library: what papier knows about the imported documents, in a
+sqlite database.
+
+A Library keeps one connection per thread (and per process), in WAL
+mode, so that the library can be read while an import writes to it.
+Statements run in autocommit mode, unless grouped with transaction(),
+which commits once at the end of the outermost block. The schema is
+versioned (PRAGMA user_version), and migrated when the library is
+opened. The functions of this module work on the library configured in
+papier.config."""
 import papier
 import sqlite3
+import contextlib
 import logging
-import os.path
 import json
-from typing import Generator
+import math
+import os
+import threading
+from typing import Self, Any, Generator, Iterable, Iterator
 
 # Logger for this plugin
 log = logging.getLogger(__name__)
@@ -12,76 +25,476 @@ log = logging.getLogger(__name__)
 db = papier.config["library"].get()
 
 
-def init_db() -> None:
-    with sqlite3.connect(db) as cursor:
-        cursor.execute("CREATE TABLE IF NOT EXISTS library("
-                       "sha256sum PRIMARY KEY, "
-                       "path TEXT, "
-                       "mtime REAL, "
-                       "text TEXT, "
-                       "tags TEXT"
-                       ")")
-        # TODO find a way to store manual inputs
+# What the results of an extractor on a document were computed from:
+# (sha256sum, extractor, version, config, inputs)
+ResultKey = tuple[str, str, str, str, str]
 
 
-# Initialize the database if it does not exist
-if not os.path.exists(db):
-    init_db()
+def _baseline(conn: sqlite3.Connection) -> None:
+    """Create the tables, and add the columns missing from databases
+    created before the schema was versioned"""
+    conn.execute("CREATE TABLE IF NOT EXISTS library("
+                 "sha256sum PRIMARY KEY, "
+                 "path TEXT, "
+                 "mtime REAL, "
+                 "size INTEGER, "
+                 "text TEXT, "
+                 "tags TEXT"
+                 ")")
+    # Watermarks of the directories scanned for import
+    conn.execute("CREATE TABLE IF NOT EXISTS directories("
+                 "path TEXT PRIMARY KEY, "
+                 "mtime REAL, "
+                 "entries INTEGER"
+                 ")")
+    # Last results of each extractor on each document, along with what
+    # they were computed from
+    conn.execute("CREATE TABLE IF NOT EXISTS results("
+                 "sha256sum TEXT, "
+                 "extractor TEXT, "
+                 "version TEXT, "
+                 "config TEXT, "
+                 "inputs TEXT, "
+                 "sure TEXT, "
+                 "unsure TEXT, "
+                 "confidence TEXT, "
+                 "PRIMARY KEY(sha256sum, extractor)"
+                 ")")
+    # TODO find a way to store manual inputs
 
+    res = conn.execute('PRAGMA table_info(library)')
+    columns = [row[1] for row in res.fetchall()]
+    if 'size' not in columns:
+        conn.execute('ALTER TABLE library ADD COLUMN size INTEGER')
+    res = conn.execute('PRAGMA table_info(results)')
+    columns = [row[1] for row in res.fetchall()]
+    if 'confidence' not in columns:
+        conn.execute('ALTER TABLE results ADD COLUMN confidence TEXT')
 
-def add(doc: papier.Document, tags: dict = {}) -> None:
-    log.info(f'inserting {doc} in the library')
-    sql = ('INSERT INTO library'
-           '(sha256sum, path, mtime, text, tags) '
-           'VALUES(?, ?, ?, ?, ?)')
-    with sqlite3.connect(db) as cursor:
-        cursor.execute(sql, (doc.sha256sum(), doc.path, doc.mtime(),
-                             doc.text, json.dumps(tags)))
 
+def _index_paths(conn: sqlite3.Connection) -> None:
+    """Look documents up by path (and mtime) without a full scan"""
+    conn.execute('CREATE INDEX IF NOT EXISTS library_path_mtime '
+                 'ON library(path, mtime)')
 
-def has(doc: papier.Document) -> bool:
-    log.info(f'checking if {doc} is in the library')
-    # First, check if the path of the document exists with the same mtime
-    sql = 'SELECT * FROM library WHERE path = ? and mtime = ?'
-    with sqlite3.connect(db) as cursor:
-        res = cursor.execute(sql, (doc.path, doc.mtime()))
-        rows = res.fetchall()
+
+def _full_text(conn: sqlite3.Connection) -> None:
+    """Index the text of the documents for full-text search. The index
+    reads the text from the library, and triggers keep it in sync"""
+    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS library_fts "
+                 "USING fts5(text, content='library', content_rowid='rowid', "
+                 "tokenize='unicode61 remove_diacritics 2')")
+    conn.execute("CREATE TRIGGER IF NOT EXISTS library_fts_insert "
+                 "AFTER INSERT ON library BEGIN "
+                 "INSERT INTO library_fts(rowid, text) "
+                 "VALUES(new.rowid, new.text); "
+                 "END")
+    conn.execute("CREATE TRIGGER IF NOT EXISTS library_fts_delete "
+                 "AFTER DELETE ON library BEGIN "
+                 "INSERT INTO library_fts(library_fts, rowid, text) "
+                 "VALUES('delete', old.rowid, old.text); "
+                 "END")
+    conn.execute("CREATE TRIGGER IF NOT EXISTS library_fts_update "
+                 "AFTER UPDATE OF text ON library BEGIN "
+                 "INSERT INTO library_fts(library_fts, rowid, text) "
+                 "VALUES('delete', old.rowid, old.text); "
+                 "INSERT INTO library_fts(rowid, text) "
+                 "VALUES(new.rowid, new.text); "
+                 "END")
+    # Index the documents already there
+    conn.execute("INSERT INTO library_fts(library_fts) VALUES('rebuild')")
+
+
+def _tags_table(conn: sqlite3.Connection) -> None:
+    """Keep the tags of the documents in their own table too, one
+    (key, value) per row and indexed, so that documents can be filtered
+    by tag in SQL. Triggers keep it in sync with the library"""
+    conn.execute("CREATE TABLE IF NOT EXISTS tags("
+                 "key TEXT, "
+                 "value, "
+                 "sha256sum TEXT, "
+                 "PRIMARY KEY(key, value, sha256sum)"
+                 ") WITHOUT ROWID")
+    conn.execute('CREATE INDEX IF NOT EXISTS tags_sha256sum '
+                 'ON tags(sha256sum)')
+    insert = ("INSERT OR IGNORE INTO tags(key, value, sha256sum) "
+              "SELECT key, value, new.sha256sum FROM json_each(new.tags) "
+              "WHERE json_valid(new.tags); ")
+    conn.execute("CREATE TRIGGER IF NOT EXISTS tags_insert "
+                 "AFTER INSERT ON library BEGIN " + insert + "END")
+    conn.execute("CREATE TRIGGER IF NOT EXISTS tags_delete "
+                 "AFTER DELETE ON library BEGIN "
+                 "DELETE FROM tags WHERE sha256sum = old.sha256sum; "
+                 "END")
+    conn.execute("CREATE TRIGGER IF NOT EXISTS tags_update "
+                 "AFTER UPDATE OF sha256sum, tags ON library BEGIN "
+                 "DELETE FROM tags WHERE sha256sum = old.sha256sum; "
+                 + insert + "END")
+    # Tags of the documents already there
+    conn.execute("INSERT OR IGNORE INTO tags(key, value, sha256sum) "
+                 "SELECT j.key, j.value, l.sha256sum "
+                 "FROM library AS l, json_each(l.tags) AS j "
+                 "WHERE json_valid(l.tags)")
+
+
+def _document_ids(conn: sqlite3.Connection) -> None:
+    """Give the documents an INTEGER PRIMARY KEY. The full-text index
+    refers to them by rowid, which VACUUM may renumber unless it is
+    declared. The rowids are kept, so that the index stays valid"""
+    conn.execute("CREATE TABLE library_ids("
+                 "id INTEGER PRIMARY KEY, "
+                 "sha256sum UNIQUE, "
+                 "path TEXT, "
+                 "mtime REAL, "
+                 "size INTEGER, "
+                 "text TEXT, "
+                 "tags TEXT"
+                 ")")
+    conn.execute("INSERT INTO library_ids "
+                 "SELECT rowid, sha256sum, path, mtime, size, text, tags "
+                 "FROM library")
+    # Along with its index and triggers, created again below
+    conn.execute("DROP TABLE library")
+    conn.execute("ALTER TABLE library_ids RENAME TO library")
+    _index_paths(conn)
+    _full_text(conn)
+    _tags_table(conn)
+
+
+# Changes to the schema, in order. A database went through the first
+# n migrations when its user_version is n. Append new ones, never edit
+# the ones already released
+MIGRATIONS = [_baseline, _index_paths, _full_text, _tags_table,
+              _document_ids]
+
+
+# Operators of the conditions on tags
+OPERATORS = ('=', '!=', '<', '<=', '>', '>=')
+
+# A condition on a tag: (key, operator, value)
+Condition = tuple[str, str, Any]
+
+
+def number(value: str) -> int | float | None:
+    """returns the number written in value, or None"""
+    for convert in (int, float):
+        try:
+            n = convert(value)
+        except ValueError:
+            continue
+        return n if math.isfinite(n) else None
+    return None
+
+
+def where(conditions: Iterable[Condition]) -> tuple[str, list]:
+    """returns the SQL expression selecting the documents of the library
+    (as l) satisfying all the conditions, and its parameters. Values are
+    compared with the tags of the same type (SQLite sorts numbers before
+    any text): a string which reads as a number matches both the number
+    and the string"""
+    sql, args = ['1'], []
+    for key, op, value in conditions:
+        if op not in OPERATORS:
+            raise papier.CommandError(f'unknown operator "{op}", expected '
+                                      f'one of {" ".join(OPERATORS)}')
+        numeric = f"(typeof(value) IN ('integer', 'real') AND value {op} ?)"
+        text = f"(typeof(value) = 'text' AND value {op} ?)"
+        if not isinstance(value, str):
+            typed, values = [numeric], [value]
+        elif (n := number(value)) is not None:
+            typed, values = [numeric, text], [n, value]
+        else:
+            typed, values = [text], [value]
+        sql.append('l.sha256sum IN (SELECT sha256sum FROM tags '
+                   f'WHERE key = ? AND ({" OR ".join(typed)}))')
+        args += [key, *values]
+    return ' AND '.join(sql), args
+
+
+class Library():
+    """A sqlite database of documents, shared by the threads of the
+    process"""
+    # Applied to every connection. In WAL mode, NORMAL only syncs on
+    # checkpoints: a crash may lose the last transactions, not corrupt
+    # the database
+    PRAGMAS = ('PRAGMA journal_mode = WAL',
+               'PRAGMA synchronous = NORMAL',
+               'PRAGMA cache_size = -16384',
+               'PRAGMA temp_store = MEMORY')
+
+    # Seconds to wait for the lock of another writer
+    TIMEOUT = 30
+
+    def __init__(self: Self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self: Self) -> sqlite3.Connection:
+        """returns the connection of the current thread"""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            # Connections cannot be shared with a forked process
+            local.conn = sqlite3.connect(self.path, timeout=self.TIMEOUT,
+                                         isolation_level=None,
+                                         cached_statements=64)
+            for pragma in self.PRAGMAS:
+                local.conn.execute(pragma)
+            local.pid = os.getpid()
+            local.depth = 0
+        return local.conn
+
+    def close(self: Self) -> None:
+        """Close the connection of the current thread"""
+        if getattr(self._local, 'pid', None) == os.getpid():
+            self._local.conn.close()
+        self._local.__dict__.clear()
+
+    @contextlib.contextmanager
+    def transaction(self: Self) -> Iterator[sqlite3.Connection]:
+        """Run the statements of the block in a single transaction,
+        committed when the outermost block ends, and rolled back if it
+        raises"""
+        conn = self.connection()
+        local = self._local
+        if local.depth == 0:
+            # Take the write lock now rather than when the first write
+            # happens, which may fail if another writer got it meanwhile
+            conn.execute('BEGIN IMMEDIATE')
+        local.depth += 1
+        try:
+            yield conn
+        except BaseException:
+            local.depth -= 1
+            if local.depth == 0:
+                conn.execute('ROLLBACK')
+            raise
+        local.depth -= 1
+        if local.depth == 0:
+            conn.execute('COMMIT')
+
+    def init(self: Self) -> None:
+        """Bring the schema up to date, applying the migrations the
+        database did not go through yet"""
+        with self.transaction() as conn:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version > len(MIGRATIONS):
+                raise papier.PapierError(
+                        f'{self.path} was created by a newer version of '
+                        f'papier (schema version {version})')
+            for i in range(version, len(MIGRATIONS)):
+                log.info(f'migrating {self.path} to schema version {i + 1}')
+                MIGRATIONS[i](conn)
+            if version != len(MIGRATIONS):
+                conn.execute(f'PRAGMA user_version = {len(MIGRATIONS)}')
+
+    # Columns of the library, as written by row()
+    INSERT = ('INSERT INTO library'
+              '(sha256sum, path, mtime, size, text, tags) '
+              'VALUES(?, ?, ?, ?, ?, ?)')
+
+    @staticmethod
+    def row(doc: papier.Document, tags: dict) -> tuple:
+        return (doc.sha256sum(), doc.path, doc.mtime(), doc.size(),
+                doc.text, json.dumps(tags))
+
+    def add(self: Self, doc: papier.Document, tags: dict = {}) -> None:
+        log.info(f'inserting {doc} in the library')
+        self.connection().execute(self.INSERT, self.row(doc, tags))
+
+    def add_many(self: Self, items: Iterable[tuple[papier.Document, dict]]
+                 ) -> None:
+        """Insert the (document, tags) items, in a single transaction"""
+        with self.transaction() as conn:
+            conn.executemany(self.INSERT, (self.row(doc, tags)
+                                           for doc, tags in items))
+
+    def upsert_many(self: Self,
+                    items: Iterable[tuple[papier.Document, dict]]) -> None:
+        """Insert the (document, tags) items, or update the documents
+        already in the library, in a single transaction"""
+        sql = (self.INSERT + ' ON CONFLICT(sha256sum) DO UPDATE SET '
+               'path = excluded.path, '
+               'mtime = excluded.mtime, '
+               'size = excluded.size, '
+               'text = excluded.text, '
+               'tags = excluded.tags')
+        with self.transaction() as conn:
+            conn.executemany(sql, (self.row(doc, tags)
+                                   for doc, tags in items))
+
+    def has(self: Self, doc: papier.Document) -> bool:
+        """Checks whether doc is in the library. Only looks at the file
+        itself, without parsing it"""
+        log.info(f'checking if {doc} is in the library')
+        conn = self.connection()
+        # First, check if the path of the document exists with the same
+        # mtime and size. This avoids reading the file.
+        sql = ('SELECT 1 FROM library '
+               'WHERE path = ? and mtime = ? and size = ?')
+        rows = conn.execute(sql, (doc.path, doc.mtime(),
+                                  doc.size())).fetchall()
         if len(rows) == 1:
             return True
-    # Then, check the checksum
-    sql = 'SELECT * FROM library WHERE sha256sum = ?'
-    with sqlite3.connect(db) as cursor:
-        res = cursor.execute(sql, (doc.sha256sum(),))
-        if len(res.fetchall()) > 0:
-            return True
-    return False
+        # Then, check the checksum
+        sql = 'SELECT 1 FROM library WHERE sha256sum = ?'
+        return conn.execute(sql, (doc.sha256sum(),)).fetchone() is not None
+
+    def update(self: Self, doc: papier.Document, tags: dict = {}) -> None:
+        log.info(f'updating {doc} in the library')
+        sql = ('UPDATE library SET '
+               'path = ?, '
+               'mtime = ?, '
+               'size = ?, '
+               'text = ?, '
+               'tags = ? '
+               'WHERE sha256sum = ?')
+        self.connection().execute(sql, (doc.path, doc.mtime(), doc.size(),
+                                        doc.text, json.dumps(tags),
+                                        doc.sha256sum()))
+
+    def delete(self: Self, doc: papier.Document) -> None:
+        log.info(f'removing {doc} from the library')
+        sql = ('DELETE FROM library WHERE sha256sum = ?')
+        self.connection().execute(sql, (doc.sha256sum(),))
+
+    def watermarks(self: Self) -> dict[str, tuple[float, int]]:
+        """returns the (mtime, number of entries) of the directories
+        scanned by the previous imports"""
+        sql = 'SELECT path, mtime, entries FROM directories'
+        res = self.connection().execute(sql)
+        return {path: (mtime, entries) for path, mtime, entries in res}
+
+    def set_watermarks(self: Self, marks: dict[str, tuple[float, int]]
+                       ) -> None:
+        log.info(f'saving the watermarks of {len(marks)} directories')
+        sql = ('INSERT OR REPLACE INTO directories'
+               '(path, mtime, entries) '
+               'VALUES(?, ?, ?)')
+        with self.transaction() as conn:
+            conn.executemany(sql, ((path, mtime, entries) for
+                                   path, (mtime, entries) in marks.items()))
+
+    def results(self: Self, keys: Iterable[ResultKey]
+                ) -> dict[ResultKey, tuple[dict, dict, dict]]:
+        """returns the (sure, unsure, confidence) results stored for the
+        keys. Results computed from anything else are ignored"""
+        sql = ('SELECT sure, unsure, confidence FROM results WHERE '
+               'sha256sum = ? AND extractor = ? AND version = ? AND '
+               'config = ? AND inputs = ?')
+        conn = self.connection()
+        res = {}
+        for key in keys:
+            row = conn.execute(sql, key).fetchone()
+            if row is not None:
+                res[key] = tuple(json.loads(column or '{}')
+                                 for column in row)
+        return res
+
+    def set_results(self: Self,
+                    results: Iterable[tuple[ResultKey,
+                                            tuple[dict, dict, dict]]]
+                    ) -> None:
+        """Store the results of extractors, replacing the previous
+        results of the same extractors on the same documents"""
+        sql = ('INSERT OR REPLACE INTO results'
+               '(sha256sum, extractor, version, config, inputs, sure, '
+               'unsure, confidence) '
+               'VALUES(?, ?, ?, ?, ?, ?, ?, ?)')
+        with self.transaction() as conn:
+            conn.executemany(sql, ((*key, *(json.dumps(column, default=str)
+                                            for column in res))
+                                   for key, res in results))
+
+    def search(self: Self, query: str, tags: dict[str, str] = {},
+               limit: int = 20) -> list[tuple[papier.Document, str, str]]:
+        """returns the (document, tags, snippet) of the documents
+        matching the FTS5 query and having the given tags, the most
+        relevant (BM25) first"""
+        cond, args = where((key, '=', value) for key, value in tags.items())
+        sql = ('SELECT l.sha256sum, l.path, l.mtime, l.tags, '
+               "snippet(library_fts, 0, '[', ']', '…', 16) "
+               'FROM library_fts JOIN library AS l '
+               'ON l.rowid = library_fts.rowid '
+               f'WHERE library_fts MATCH ? AND {cond} '
+               'ORDER BY rank LIMIT ?')
+        args = [query] + args + [limit]
+        try:
+            rows = self.connection().execute(sql, args).fetchall()
+        except sqlite3.OperationalError as e:
+            raise papier.CommandError(f'invalid query "{query}": {e}')
+        return [(papier.Document.from_library(path, sha256sum, mtime),
+                 tags, snippet)
+                for sha256sum, path, mtime, tags, snippet in rows]
+
+    def list(self: Self, conditions: Iterable[Condition] = ()
+             ) -> Generator:
+        """yields (document, tags) for every document of the library
+        satisfying the conditions on its tags. The documents are
+        handles, which do not read the files"""
+        cond, args = where(conditions)
+        sql = ('SELECT l.sha256sum, l.path, l.mtime, l.tags '
+               f'FROM library AS l WHERE {cond}')
+        for row in self.connection().execute(sql, args):
+            (sha256sum, path, mtime, tags) = row
+            doc = papier.Document.from_library(path, sha256sum, mtime)
+            yield (doc, tags)
+
+
+# The library configured in papier.config, with an up to date schema
+_library = Library(db)
+_library.init()
+
+
+def transaction() -> contextlib.AbstractContextManager:
+    return _library.transaction()
+
+
+def add(doc: papier.Document, tags: dict = {}) -> None:
+    _library.add(doc, tags)
+
+
+def add_many(items: Iterable[tuple[papier.Document, dict]]) -> None:
+    _library.add_many(items)
+
+
+def upsert_many(items: Iterable[tuple[papier.Document, dict]]) -> None:
+    _library.upsert_many(items)
+
+
+def has(doc: papier.Document) -> bool:
+    return _library.has(doc)
 
 
 def update(doc: papier.Document, tags: dict = {}) -> None:
-    log.info(f'updating {doc} in the library')
-    sql = ('UPDATE library SET '
-           'path = ?, '
-           'mtime = ?, '
-           'text = ?, '
-           'tags = ? '
-           'WHERE sha256sum = ?')
-    with sqlite3.connect(db) as cursor:
-        cursor.execute(sql, (doc.path, doc.mtime(), doc.text,
-                             json.dumps(tags), doc.sha256sum()))
+    _library.update(doc, tags)
 
 
 def delete(doc: papier.Document) -> None:
-    log.info(f'removing {doc} from the library')
-    sql = ('DELETE FROM library WHERE sha256sum = ?')
-    with sqlite3.connect(db) as cursor:
-        cursor.execute(sql, (doc.sha256sum(),))
-
-
-def list() -> Generator:
-    sql = 'SELECT sha256sum, path, mtime, text, tags FROM library'
-    with sqlite3.connect(db) as conn:
-        cursor = conn.execute(sql, ())
-        for row in cursor:
-            (sha256sum, path, _, _, tags) = row
-            doc = papier.Document.from_library(path, sha256sum)
-            yield (doc, tags)
+    _library.delete(doc)
+
+
+def watermarks() -> dict[str, tuple[float, int]]:
+    return _library.watermarks()
+
+
+def set_watermarks(marks: dict[str, tuple[float, int]]) -> None:
+    _library.set_watermarks(marks)
+
+
+def results(keys: Iterable[ResultKey]
+            ) -> dict[ResultKey, tuple[dict, dict, dict]]:
+    return _library.results(keys)
+
+
+def set_results(results: Iterable[tuple[ResultKey, tuple[dict, dict, dict]]]
+                ) -> None:
+    _library.set_results(results)
+
+
+def search(query: str, tags: dict[str, str] = {}, limit: int = 20
+           ) -> list[tuple[papier.Document, str, str]]:
+    return _library.search(query, tags, limit)
+
+
+def list(conditions: Iterable[Condition] = ()) -> Generator:
+    return _library.list(conditions)
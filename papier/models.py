@@ -0,0 +1,110 @@
+"""Process-wide registry of NLP models.
+
+Loading a model usually takes much longer than running it, so plugins
+get their models from here: each model is loaded once per process and
+kept as long as the models fit in the memory budget (models.memory, in
+megabytes). When they do not, the least recently used ones are
+dropped."""
+import papier
+import collections
+import gc
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Hashable, Iterable, Iterator
+
+
+# Logger for this module
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class Model():
+    model: Any = field(repr=False)
+    # Estimated memory footprint, in bytes
+    size: int
+
+
+# Loaded models, least recently used first
+_models: collections.OrderedDict[Hashable, Model] = collections.OrderedDict()
+
+# Loading is serialized, so that a model is never loaded twice
+_lock = threading.RLock()
+
+
+def rss() -> int:
+    """returns the resident memory of the process, in bytes, or 0 if it
+    cannot be known"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def budget() -> int:
+    """returns the memory the models may use, in bytes (0: no limit)"""
+    return papier.config['models']['memory'].get(int) * 1024 * 1024
+
+
+def key(name: str, lang: str = '', config: dict = None) -> Hashable:
+    return (name, lang, json.dumps(config, sort_keys=True, default=str))
+
+
+def get(factory: Callable[[], Any], name: str, lang: str = '',
+        config: dict = None, size: int = None) -> Any:
+    """returns the model identified by (name, lang, config), calling
+    factory to load it if necessary. size is the memory the model takes,
+    in megabytes. If not given, it is estimated as the growth of the
+    resident memory while loading, which also counts what other threads
+    allocate meanwhile"""
+    k = key(name, lang, config)
+    with _lock:
+        if k in _models:
+            _models.move_to_end(k)
+            return _models[k].model
+        log.info(f'loading model {name} (lang={lang}, config={config})')
+        before = rss()
+        model = factory()
+        if size is None:
+            size = max(rss() - before, 0)
+        else:
+            size *= 1024 * 1024
+        _models[k] = Model(model, size)
+        evict()
+        return model
+
+
+def evict() -> None:
+    """Drop the least recently used models until the models fit in the
+    budget. The most recently used model is always kept"""
+    limit = budget()
+    if limit <= 0:
+        return
+    with _lock:
+        total = sum(m.size for m in _models.values())
+        dropped = False
+        while len(_models) > 1 and total > limit:
+            k, m = _models.popitem(last=False)
+            log.info(f'unloading model {k} ({m.size} bytes)')
+            total -= m.size
+            dropped = True
+        if dropped:
+            gc.collect()
+
+
+def clear() -> None:
+    """Drop all the models"""
+    with _lock:
+        _models.clear()
+
+
+def pipe(nlp: Any, texts: Iterable, as_tuples: bool = False) -> Iterator:
+    """Run a spaCy pipeline over texts, in batches, as configured. With
+    as_tuples, texts are (text, context) pairs"""
+    conf = papier.config['models']
+    return nlp.pipe(texts, as_tuples=as_tuples,
+                    batch_size=conf['batch_size'].get(int),
+                    n_process=conf['n_process'].get(int))
@@ -0,0 +1,145 @@
+"""Persistent cache of OCR results, so that OCR runs only once per file.
+
+Entries are keyed by the checksum of the source file, the OCR mode and
+the version of ocrmypdf. Each entry holds the OCRed pdf and, once
+extracted, the text and layout of its pages. When the cache grows over
+its maximal size, the least recently used entries are evicted."""
+import papier
+import papier.files as files
+import os
+import os.path
+import hashlib
+import json
+import logging
+import tempfile
+from typing import Any
+
+
+# Logger for this module
+log = logging.getLogger(__name__)
+
+
+def directory() -> str:
+    path = papier.config['ocr_cache']['directory'].as_str()
+    return os.path.expanduser(path)
+
+
+def max_size() -> int:
+    """maximal size of the cache in bytes"""
+    return papier.config['ocr_cache']['max_size'].get(int) * 1024 * 1024
+
+
+def key(sha256sum: str, ocr: Any) -> str | None:
+    """returns the key of the entry for the given file and OCR mode, or
+    None if the result should not be cached"""
+    if max_size() <= 0:
+        return None
+    if ocr not in ('yes', True, 'force'):
+        return None
+    # Slow to import: only when OCR runs
+    import ocrmypdf
+    desc = f'{sha256sum}:{ocr}:{ocrmypdf.__version__}'
+    return hashlib.sha256(desc.encode()).hexdigest()
+
+
+def _path(key: str, ext: str) -> str:
+    return os.path.join(directory(), f'{key}.{ext}')
+
+
+def _get(key: str, ext: str) -> str | None:
+    path = _path(key, ext)
+    try:
+        # Mark the entry as recently used
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    log.info(f'ocr cache hit: {path}')
+    return path
+
+
+def _put(key: str, ext: str, src: str) -> None:
+    """Move src in the cache"""
+    os.makedirs(directory(), exist_ok=True)
+    os.replace(src, _path(key, ext))
+    evict()
+
+
+def get(key: str) -> str | None:
+    """returns the path of the cached OCRed pdf, if any. Since the entry
+    may be evicted at any time, callers should rather use checkout()"""
+    return _get(key, 'pdf')
+
+
+def checkout(key: str) -> str | None:
+    """returns a private copy of the cached OCRed pdf, if any. The caller
+    is responsible for the copy"""
+    path = get(key)
+    if path is None:
+        return None
+    tmpfile = tempfile.NamedTemporaryFile(delete=False).name
+    try:
+        files.clone(path, tmpfile)
+    except FileNotFoundError:
+        # Evicted in the meantime
+        os.remove(tmpfile)
+        return None
+    return tmpfile
+
+
+def put(key: str, pdf: str) -> None:
+    """Store a copy of the OCRed pdf in the cache"""
+    os.makedirs(directory(), exist_ok=True)
+    tmpfile = tempfile.NamedTemporaryFile(dir=directory(), delete=False).name
+    files.clone(pdf, tmpfile)
+    _put(key, 'pdf', tmpfile)
+
+
+def get_pages(key: str) -> list[tuple[str, list]] | None:
+    """returns the cached text and layout of the pages of the pdf, if
+    any"""
+    path = _get(key, 'json')
+    if path is None:
+        return None
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def put_pages(key: str, pages: list[tuple[str, list]]) -> None:
+    """Store the text and layout of the pages of the pdf in the cache"""
+    os.makedirs(directory(), exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8',
+                                     dir=directory(), delete=False) as tmp:
+        json.dump(pages, tmp)
+    _put(key, 'json', tmp.name)
+
+
+def evict() -> None:
+    """Remove the least recently used entries until the cache fits in its
+    maximal size"""
+    entries = []
+    total = 0
+    with os.scandir(directory()) as it:
+        for entry in it:
+            # Skip the files being written
+            if not entry.name.endswith(('.pdf', '.json')):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+    entries.sort()
+    limit = max_size()
+    for mtime, size, path in entries:
+        if total <= limit:
+            break
+        log.info(f'ocr cache: evicting {path}')
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
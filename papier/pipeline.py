@@ -0,0 +1,279 @@
+"""Run a stream of items through stages of workers joined by bounded
+queues"""
+import queue
+import threading
+import time
+import logging
+import multiprocessing
+import concurrent.futures
+from dataclasses import dataclass, field
+from typing import Self, Any, Callable, Iterable
+
+
+# Logger for this module
+log = logging.getLogger(__name__)
+
+
+# Marks the end of the stream of items
+_END = object()
+
+
+# How often blocked workers check whether the pipeline was aborted
+_POLL = 0.1
+
+
+class _Aborted(Exception):
+    """Raised in the workers when the pipeline stops on an error"""
+    pass
+
+
+@dataclass
+class Stage():
+    """A step of the pipeline. func receives an item and returns the item
+    to hand to the next stage, or None to drop it. Stages running in
+    processes need func, its arguments and its results to be picklable.
+
+    With a batch_size, func receives a list of up to batch_size items,
+    and returns the list of their results. Once it got the first item of
+    a batch, a worker waits at most batch_wait seconds for the others.
+
+    errors are the exceptions func raises about a single item, unless
+    they also are fatal: the item is logged (as label describes it) and
+    dropped, and the others go on. A batch raising one of them runs again
+    item by item. Other exceptions stop the pipeline. discard releases
+    the items the stage drops, and the ones left in its queue when the
+    pipeline stops, unless the stage drains: it then still processes
+    them, e.g. to keep the work already done"""
+    name: str
+    func: Callable = field(repr=False)
+    workers: int = 1
+    processes: bool = False
+    batch_size: int = 0
+    batch_wait: float = 0.5
+    errors: tuple[type[BaseException], ...] = ()
+    fatal: tuple[type[BaseException], ...] = ()
+    discard: Callable[[Any], None] = field(default=None, repr=False)
+    drain: bool = False
+    label: Callable[[Any], str] = field(default=str, repr=False)
+
+
+class Pipeline():
+    """Stages run concurrently. Each stage reads from a queue of at most
+    queue_size items, so that a slow stage blocks the ones feeding it
+    instead of letting their results pile up in memory"""
+
+    def __init__(self: Self, stages: list[Stage], queue_size: int = 16
+                 ) -> None:
+        self.stages = stages
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._abort = threading.Event()
+        self._error: BaseException | None = None
+        self._running: dict[str, int] = {}
+        self._queues: list[queue.Queue] = []
+        # Map stage index -> items for it, which could not be queued
+        # once the pipeline stopped
+        self._left: dict[int, list[Any]] = {}
+
+    def _put(self: Self, i: int, item: Any) -> None:
+        """Queue item for the stage i"""
+        q = self._queues[i]
+        while True:
+            if self._abort.is_set():
+                raise _Aborted()
+            try:
+                q.put(item, timeout=_POLL)
+                return
+            except queue.Full:
+                pass
+
+    def _forward(self: Self, i: int, items: list[Any]) -> None:
+        """Queue the items (but None) for the stage i, keeping them for
+        later if the pipeline stops meanwhile"""
+        items = [item for item in items if item is not None]
+        for n, item in enumerate(items):
+            try:
+                self._put(i, item)
+            except _Aborted:
+                with self._lock:
+                    self._left.setdefault(i, []).extend(items[n:])
+                raise
+
+    def _get(self: Self, q: queue.Queue) -> Any:
+        while True:
+            if self._abort.is_set():
+                raise _Aborted()
+            try:
+                return q.get(timeout=_POLL)
+            except queue.Empty:
+                pass
+
+    def _fail(self: Self, error: BaseException) -> None:
+        with self._lock:
+            if self._error is None:
+                self._error = error
+        self._abort.set()
+
+    def _discard(self: Self, stage: Stage, item: Any) -> None:
+        if stage.discard is None:
+            return
+        try:
+            stage.discard(item)
+        except Exception as e:
+            log.warning(f'stage {stage.name} cannot release '
+                        f'{stage.label(item)}: {e}')
+
+    def _call(self: Self, stage: Stage, batch: list[Any],
+              pool: concurrent.futures.Executor | None) -> list[Any]:
+        """returns the results of the stage on the batch, without the
+        ones of the items it failed on"""
+        arg = batch if stage.batch_size else batch[0]
+        try:
+            if pool is not None:
+                res = pool.submit(stage.func, arg).result()
+            else:
+                res = stage.func(arg)
+        except stage.errors as e:
+            if isinstance(e, stage.fatal + (
+                    concurrent.futures.BrokenExecutor,)):
+                raise
+            if len(batch) > 1:
+                # Find the items at fault
+                return [res for item in batch
+                        for res in self._call(stage, [item], pool)]
+            log.error(f'stage {stage.name} failed on '
+                      f'{stage.label(batch[0])}: {e}')
+            self._discard(stage, batch[0])
+            return []
+        return res if stage.batch_size else [res]
+
+    def _batch(self: Self, stage: Stage, inbox: queue.Queue
+               ) -> tuple[list[Any], bool]:
+        """returns the next items for the stage, and whether the end of
+        the stream was reached"""
+        item = self._get(inbox)
+        if item is _END:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + stage.batch_wait
+        while len(batch) < stage.batch_size:
+            left = deadline - time.monotonic()
+            # Once the pipeline stops, the items got so far are processed
+            if left <= 0 or self._abort.is_set():
+                break
+            try:
+                item = inbox.get(timeout=min(left, _POLL))
+            except queue.Empty:
+                continue
+            if item is _END:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _work(self: Self, i: int, pool: concurrent.futures.Executor | None
+              ) -> None:
+        stage = self.stages[i]
+        last_stage = (i + 1 == len(self.stages))
+        batch = []
+        try:
+            while True:
+                batch, ended = self._batch(stage, self._queues[i])
+                if batch:
+                    results = self._call(stage, batch, pool)
+                    batch = []
+                    if not last_stage:
+                        self._forward(i + 1, results)
+                if ended:
+                    # The last worker of the stage forwards the end of
+                    # the stream, the others leave it for their siblings
+                    with self._lock:
+                        self._running[stage.name] -= 1
+                        last = self._running[stage.name] == 0
+                    if not last:
+                        self._put(i, _END)
+                    elif not last_stage:
+                        self._put(i + 1, _END)
+                    return
+        except _Aborted:
+            pass
+        except BaseException as e:
+            log.error(f'stage {stage.name} failed on '
+                      f'{[stage.label(item) for item in batch]}: {e}')
+            self._fail(e)
+            for item in batch:
+                self._discard(stage, item)
+
+    def _finish(self: Self) -> None:
+        """Once the pipeline stopped, pass the items left in the queues
+        to the stages which drain, and release the others"""
+        for i, stage in enumerate(self.stages):
+            items = self._left.pop(i, [])
+            while True:
+                try:
+                    item = self._queues[i].get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _END:
+                    items.append(item)
+            if not stage.drain:
+                for item in items:
+                    self._discard(stage, item)
+                continue
+            size = stage.batch_size or 1
+            for n in range(0, len(items), size):
+                batch = items[n:n + size]
+                try:
+                    results = self._call(stage, batch, None)
+                except Exception as e:
+                    log.error(f'stage {stage.name} failed on '
+                              f'{[stage.label(item) for item in batch]}: '
+                              f'{e}')
+                    for item in batch:
+                        self._discard(stage, item)
+                    continue
+                if i + 1 < len(self.stages):
+                    self._left.setdefault(i + 1, []).extend(
+                            res for res in results if res is not None)
+
+    def run(self: Self, items: Iterable) -> None:
+        """Feed the items to the first stage and wait until every stage
+        is done. Re-raises the first error met by a worker, once the
+        stages which drain processed the items left"""
+        self._abort.clear()
+        self._error = None
+        self._left = {}
+        self._queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        pools, threads = [], []
+        for i, stage in enumerate(self.stages):
+            pool = None
+            if stage.processes:
+                # Forking a process that runs threads is unsafe
+                pool = concurrent.futures.ProcessPoolExecutor(
+                        stage.workers,
+                        mp_context=multiprocessing.get_context('spawn'))
+                pools.append(pool)
+            self._running[stage.name] = stage.workers
+            for n in range(stage.workers):
+                t = threading.Thread(
+                        target=self._work, args=(i, pool),
+                        name=f'{stage.name}-{n}',
+                        daemon=True)
+                threads.append(t)
+                t.start()
+        try:
+            for item in items:
+                self._forward(0, [item])
+            self._put(0, _END)
+        except _Aborted:
+            pass
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            for t in threads:
+                t.join()
+            for pool in pools:
+                pool.shutdown(cancel_futures=True)
+            if self._abort.is_set():
+                self._finish()
+        if self._error is not None:
+            raise self._error
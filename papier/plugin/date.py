@@ -1,39 +1,194 @@
 import papier
 import datetime
+import functools
+import re
+import unicodedata
 import dateparser
 import dateparser.search
 from dateparser_data.settings import default_parsers
-from typing import Any
+from typing import Any, Callable, Iterator
 
+try:
+    # Internals of dateparser, which tell the pieces of text that may
+    # contain a date. Without them, whole texts are parsed
+    from dateparser.languages.loader import default_loader
+    from dateparser.timezone_parser import word_is_tz
+except ImportError:
+    default_loader = None
 
-@papier.extracts(consumes=['lang'], produces=['date'])
-def extract_date(document: papier.Document, tags: dict[str, Any]
-                 ) -> tuple[dict[str, Any], dict[str, Any]]:
 
-    lang = tags['lang']
-    ref = datetime.datetime.now()
+# Built once, and shared by all the calls to dateparser
+SETTINGS = {
+        'REQUIRE_PARTS': ['year', 'month'],
+        'PREFER_DAY_OF_MONTH': 'first',
+        'PARSERS': [p for p in default_parsers if p != 'relative-time'],
+        }
+
+# Characters ending a sentence for dateparser, depending on the
+# sentence_splitter_group of the language. A date never spans two
+# sentences, and dateparser parses the sentences independently
+_SENTENCE_ENDS = {
+        1: '\r\n!?;…',
+        2: '\r\n!?;…¡¿',
+        3: '\r\n|!?;',
+        4: '\r\n。…‥!?？！;',
+        5: '\r\n',
+        6: '\r\n؟!…',
+        }
+
+# Since we require a year, a date has a digit
+_DIGIT = re.compile(r'\d')
+
+# Words, as dateparser splits them
+_WORD = re.compile(r'\S+')
+
+# Words dateparser knows in every language
+_ALWAYS_KNOWN = {'t', 'z', 'gmt', 'utc'}
+
+# Punctuation dateparser strips from words before looking them up
+_PUNCTUATION = '()"\'{}[],.:;'
+
 
-    settings = {}
-    settings['REQUIRE_PARTS'] = ['year', 'month']
-    settings['PREFER_DAY_OF_MONTH'] = 'first'
-    settings['PARSERS'] = [p for p in default_parsers if p != 'relative-time']
+def _folded(word: str) -> str:
+    """returns word lowercased and without accents, as dateparser
+    normalizes it"""
+    word = unicodedata.normalize('NFKD', word.lower())
+    return ''.join(c for c in word if not unicodedata.combining(c))
 
-    languages = None
-    if lang is not None:
-        languages = [lang]
 
+def _strings(data: Any) -> Iterator[str]:
+    """returns the strings nested in data (lists and dicts)"""
+    if isinstance(data, str):
+        yield data
+    elif isinstance(data, dict):
+        for key, value in data.items():
+            yield key
+            yield from _strings(value)
+    elif isinstance(data, list):
+        for value in data:
+            yield from _strings(value)
+
+
+@functools.cache
+def language(lang: str) -> tuple[re.Pattern, frozenset[str]] | None:
+    """returns the regex matching the ends of the sentences of lang, and
+    the words of lang dateparser may use in a date (all the words of its
+    dictionary, and more). None if dateparser does not know lang.
+
+    dateparser does not split after some abbreviations and, for some
+    languages, after digits: only the ends which do not follow a letter
+    or a digit are matched, so that they also are ends for dateparser"""
+    if default_loader is None:
+        return None
     try:
-        candidates = [(text, date) for (text, date) in
-                      dateparser.search.search_dates(
-                          document.text,
-                          languages=languages,
-                          settings=settings) if
-                      date <= ref]
-    except TypeError:
-        candidates = []
+        info = default_loader.get_locale(lang).info
+    except ValueError:
+        return None
+    ends = re.escape(_SENTENCE_ENDS[info.get('sentence_splitter_group', 1)])
+    known = set(_ALWAYS_KNOWN)
+    for key, value in info.items():
+        if key not in ('name', 'date_order', 'sentence_splitter_group'):
+            for string in _strings(value):
+                words = re.findall(r'[^\W\d_]+', string)
+                known.update(w.lower() for w in words)
+                known.update(_folded(w) for w in words)
+    return re.compile(rf'(?<![^\W_])[{ends}]+'), frozenset(known)
+
+
+def candidates(text: str, lang: str) -> Iterator[str] | None:
+    """returns the pieces of text that may contain a date, in order, or
+    None if they cannot be told apart for lang.
+
+    dateparser parses separately the runs of words it knows (numbers,
+    month names...) within each sentence: the pieces are cut at the ends
+    of sentences and at the words unknown to dateparser, so that parsing
+    them one by one gives the same dates as parsing the whole text"""
+    lang_info = language(lang)
+    if lang_info is None:
+        return None
+    ends, known = lang_info
+
+    def breaks(word: str) -> bool:
+        word = word.strip(_PUNCTUATION)
+        return (word.isalpha() and word.lower() not in known
+                and _folded(word) not in known and not word_is_tz(word))
+
+    def pieces() -> Iterator[str]:
+        start = 0
+        for m in ends.finditer(text):
+            yield from sentence_pieces(start, m.start())
+            start = m.end()
+        yield from sentence_pieces(start, len(text))
+
+    def sentence_pieces(start: int, end: int) -> Iterator[str]:
+        for m in _WORD.finditer(text, start, end):
+            if breaks(m.group()):
+                yield text[start:m.start()]
+                start = m.end()
+        yield text[start:end]
+
+    return (p for p in pieces() if _DIGIT.search(p))
+
+
+def _detected(lang: str) -> Callable:
+    """returns a language detection function always answering lang"""
+    def detect(text: str, confidence_threshold: float) -> list[str]:
+        return [lang]
+    return detect
+
+
+def search_dates(text: str, lang: str | None
+                 ) -> tuple[tuple[str, datetime.datetime], ...]:
+    """returns the dates found in text.
+
+    dateparser gives up on a text without any letter specific to lang.
+    Pieces of a document are short, so the language is not checked for
+    them: it was for the whole document"""
+    if lang is not None and language(lang) is not None:
+        res = dateparser.search.search_dates(
+                text, settings=SETTINGS,
+                detect_languages_function=_detected(lang))
+    else:
+        languages = None if lang is None else [lang]
+        res = dateparser.search.search_dates(text, languages=languages,
+                                             settings=SETTINGS)
+    return tuple(res or ())
+
+
+@functools.lru_cache(maxsize=16384)
+def search(text: str, lang: str | None
+           ) -> tuple[tuple[str, datetime.datetime], ...]:
+    """returns the dates found in a piece of text, memoized: the same
+    pieces show up in many documents"""
+    return search_dates(text, lang)
+
+
+def first_date(text: str, lang: str | None, ref: datetime.datetime
+               ) -> datetime.datetime | None:
+    """returns the first date of text which is not after ref. Only the
+    candidate substrings go through dateparser, until one has a date.
+    Whole texts are not memoized: they seldom show up twice"""
+    texts = None if lang is None else candidates(text, lang)
+    if texts is None:
+        found = search_dates(text, lang)
+    else:
+        found = (d for t in texts for d in search(t, lang))
+    for _, date in found:
+        if date <= ref:
+            return date
+    return None
+
+
+# The date of a document is usually stated in its first pages
+@papier.extracts(consumes=['lang'], produces=['date'],
+                 budget=papier.Budget(pages=2))
+def extract_date(document: papier.Document, tags: dict[str, Any]
+                 ) -> tuple[dict[str, Any], dict[str, Any]]:
+
+    date = first_date(document.text, tags.get('lang'), datetime.datetime.now())
 
     res = 'XXXX-XX-XX'
-    if len(candidates) > 0:
-        res = candidates[0][1].strftime("%Y-%m-%d")
+    if date is not None:
+        res = date.strftime("%Y-%m-%d")
 
     return ({'date': res}, {})
@@ -1,20 +1,34 @@
 import papier
+import papier.models
 import spacy
 from typing import Any
 
 
-@papier.extracts(consumes=['lang'], produces=[''])
-def extract_date(document: papier.Document, tags: dict[str, Any]
-                 ) -> tuple[dict[str, Any], dict[str, Any]]:
-    if 'lang' not in tags or tags['lang'] != 'en':
-        return ({'date': 'XXXX-XX-XX'}, {})
-
+def date_finder() -> spacy.language.Language:
     nlp = spacy.blank('en')
     nlp.add_pipe('find_dates')
+    return nlp
+
+
+@papier.extracts(consumes=['lang'], produces=['date'], batch=True,
+                 budget=papier.Budget(pages=2))
+def extract_date(pairs: list[tuple[papier.Document, dict[str, Any]]]
+                 ) -> list[tuple[dict[str, Any], dict[str, Any]]]:
+    res = []
+    english = []
+    for i, (document, tags) in enumerate(pairs):
+        if 'lang' not in tags or tags['lang'] != 'en':
+            res.append(({'date': 'XXXX-XX-XX'}, {}))
+        else:
+            res.append(({}, {}))
+            english.append((document.text, i))
+
+    nlp = papier.models.get(date_finder, 'find_dates', 'en')
 
-    doc = nlp(document.text)
-    for ent in doc.ents:
-        if ent.label_ == 'DATE':
-            date = ent._.date[:10]
-            return ({'date': date}, {})
-    return ({}, {})
+    for doc, i in papier.models.pipe(nlp, english, as_tuples=True):
+        for ent in doc.ents:
+            if ent.label_ == 'DATE':
+                date = ent._.date[:10]
+                res[i] = ({'date': date}, {})
+                break
+    return res
@@ -1,43 +1,118 @@
 import papier
-from typing import Any
-import spacy
+import papier.models
+import functools
+import collections
+from typing import Any, TYPE_CHECKING
 import logging
-import huggingface_hub.utils
+
+# spaCy is slow to import: only when the model is loaded
+if TYPE_CHECKING:
+    import spacy
 
 
 # Get rid of the annoying message from transformers/tokenization_utils_base.py
 logging.getLogger('transformers.tokenization_utils_base').setLevel(
         logging.CRITICAL)
 
-# Get rid of the download progress bars
-huggingface_hub.utils.disable_progress_bars()
-
 
-@papier.extracts(consumes=['lang'], produces=['emmitter'])
-def extract_emmitter(document: papier.Document, tags: dict[str, Any]
-                     ) -> tuple[dict[str, Any], dict[str, Any]]:
-    if 'lang' not in tags:
-        return {}
-    lang = tags['lang']
+gliner_config = {
+        'gliner_model': 'gliner-community/gliner_small-v2.5',
+        'chunk_size': 250,
+        'labels': ['person', 'company'],
+        'style': 'ent'
+        }
 
-    emmitter = ''
-
-    gliner_config = {
-            'gliner_model': 'gliner-community/gliner_small-v2.5',
-            'chunk_size': 250,
-            'labels': ['person', 'company'],
-            'style': 'ent'
-            }
 
+def gliner(lang: str) -> 'spacy.language.Language':
+    import spacy
+    import huggingface_hub.utils
+    # Get rid of the download progress bars
+    huggingface_hub.utils.disable_progress_bars()
     nlp = spacy.blank(lang)
     nlp.add_pipe('gliner_spacy', config=gliner_config)
+    return nlp
 
-    for part in document.important_parts():
-        doc = nlp(part)
-        for ent in doc.ents:
-            if ent.label_ == 'company':
-                emmitter = ent.text
-                break
-        if emmitter:
+
+def windows(parts: list[str], size: int, max_parts: int, max_chars: int
+            ) -> list[list[str]]:
+    """Pack the first max_parts parts, up to max_chars characters in
+    total, into few windows of at most size characters once joined by
+    newlines: each part goes to the first window with enough room, so
+    that the first windows hold the first parts (0: no limit). returns
+    the parts of each window"""
+    if max_parts:
+        parts = parts[:max_parts]
+    res: list[list[str]] = []
+    # Characters in each window, separators included
+    lengths: list[int] = []
+    total = 0
+    for part in parts:
+        if max_chars:
+            part = part[:max_chars - total]
+        if size:
+            part = part[:size]
+        if not part:
             break
-    return ({'emmitter': emmitter}, {})
+        total += len(part)
+        for n, length in enumerate(lengths):
+            if not size or length + 1 + len(part) <= size:
+                res[n].append(part)
+                lengths[n] += 1 + len(part)
+                break
+        else:
+            res.append([part])
+            lengths.append(len(part))
+    return res
+
+
+def within_part(parts: list[str], start: int, end: int) -> bool:
+    """returns whether the characters start:end of the parts joined by
+    newlines all belong to the same part"""
+    offset = 0
+    for part in parts:
+        if start < offset + len(part):
+            return start >= offset and end <= offset + len(part)
+        offset += len(part) + 1
+    return False
+
+
+@papier.extracts(consumes=['lang'], produces=['emmitter'], batch=True)
+def extract_emmitter(pairs: list[tuple[papier.Document, dict[str, Any]]]
+                     ) -> list[tuple[dict[str, Any], dict[str, Any]]]:
+    conf = papier.config['emmitter']
+    max_parts = conf['max_parts'].get(int)
+    max_chars = conf['max_chars'].get(int)
+
+    res = []
+    # Map lang -> {index of the document: its windows, largest fonts first}
+    todo = collections.defaultdict(dict)
+    for i, (document, tags) in enumerate(pairs):
+        if 'lang' not in tags:
+            res.append(({}, {}))
+            continue
+        res.append(({'emmitter': ''}, {}))
+        # important_parts() are sorted by font size
+        todo[tags['lang']][i] = windows(document.important_parts(),
+                                        gliner_config['chunk_size'],
+                                        max_parts, max_chars)
+
+    for lang, docs in todo.items():
+        nlp = papier.models.get(functools.partial(gliner, lang),
+                                'gliner_spacy', lang, gliner_config)
+        # Each round runs the next window of every document without a
+        # company yet, in a single batch
+        rounds = max((len(w) for w in docs.values()), default=0)
+        for n in range(rounds):
+            batch = [('\n'.join(w[n]), i) for i, w in docs.items()
+                     if n < len(w) and not res[i][0]['emmitter']]
+            if not batch:
+                break
+            for doc, i in papier.models.pipe(nlp, batch, as_tuples=True):
+                for ent in doc.ents:
+                    # The parts of a window are unrelated: an entity
+                    # spanning two of them is not one
+                    if ent.label_ == 'company' and within_part(
+                            docs[i][n], ent.start_char, ent.end_char):
+                        res[i] = ({'emmitter': ent.text}, {})
+                        break
+    return res
@@ -3,15 +3,20 @@
 import os
 import re
 import argparse
+import contextlib
+import functools
 from papier.cli.commands import command, add_argument
 import papier
 import papier.library
+import papier.extractor
+import papier.plugins
+import papier.tags
+from papier.pipeline import Pipeline, Stage
 import confuse
 from tempfile import NamedTemporaryFile as TempFile
 import logging
-from pypdf import PdfReader, PdfWriter
 from argcomplete.completers import FilesCompleter
-from typing import Generator, List, Any
+from typing import Generator, List, Any, Callable
 import tqdm
 
 
@@ -24,18 +29,57 @@ PDF = re.compile(r'.*\.pdf', re.IGNORECASE)
 
 
 papier.declare_event('imported',
-                     'called after a file is imported in the database. '
-                     'Arguments: document, tags')
-
-
-def find_pdfs(path: str) -> Generator[str, str, str]:
-    """returns all the pdfs under a given path"""
-    if os.path.isfile(path):
-        if PDF.match(path):
+                     'called when a file is imported, right before it is '
+                     'stored in the database. '
+                     'Handlers may change document.path. '
+                     'Arguments: document, tags', __name__)
+
+
+def find_pdfs(path: str, known: dict[str, tuple[float, int]] = {},
+              seen: dict[str, tuple[float, int]] = None
+              ) -> Generator[str, None, None]:
+    """returns all the pdfs under a given path, as they are found.
+
+    The watermark (mtime, number of entries) of every directory visited
+    is recorded in seen. Directories whose watermark matches the one in
+    known are only searched for subdirectories: their files are assumed
+    to have been imported already. Note that modifying a file in place
+    does not change the watermark of its directory."""
+    if not os.path.isdir(path):
+        if os.path.isfile(path) and PDF.match(path):
             yield path
-    elif os.path.isdir(path):
-        for p in os.listdir(path):
-            yield from find_pdfs(os.path.join(path, p))
+        return
+
+    # Iterative walk: (directory, its mtime)
+    stack = [(path, os.stat(path).st_mtime)]
+    while stack:
+        directory, mtime = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = [entry for entry in it]
+        except OSError as e:
+            log.warning(f'cannot scan {directory}: {e}')
+            continue
+
+        key = os.path.abspath(directory)
+        mark = (mtime, len(entries))
+        unchanged = known.get(key) == mark
+        if seen is not None:
+            seen[key] = mark
+
+        subdirs = []
+        for entry in entries:
+            try:
+                # is_dir()/is_file() reuse the file type given by scandir
+                if entry.is_dir():
+                    subdirs.append((entry.path, entry.stat().st_mtime))
+                elif not unchanged and entry.is_file():
+                    if PDF.match(entry.name):
+                        yield entry.path
+            except OSError as e:
+                log.warning(f'cannot stat {entry.path}: {e}')
+        # Visit the subdirectories in listing order
+        stack.extend(reversed(subdirs))
 
 
 def get_conf() -> str:
@@ -52,80 +96,366 @@ def get_conf() -> str:
     return papier.config['import'].get(params)
 
 
-def process(path: str) -> None:
-    log.info(f'processing {path}')
-    doc = papier.Document.from_import(path)
-    hide_progress = (not papier.config['progress'].get(bool))
-
+def checksum(path: str) -> tuple[str, str] | None:
+    """hash stage: returns the path along with its sha256sum, or None if
+    the file is already known. Nothing is parsed at this point"""
+    doc = papier.Document(path)
     if papier.library.has(doc):
         log.info(f'skipping {path}')
-        return
-
-    tags, choices = dict(), dict()
-
-    progressbar = tqdm.tqdm(papier.extractors, disable=hide_progress)
-    for e in progressbar:
-        progressbar.set_description(f'[{doc.path}] {e.plugin}')
-
-        sure, unsure = e.extract(doc, tags)
-
-        # Handle faulty plugins
-        for tag in unsure:
-            if tag in sure:
-                log.warning(f'{e.plugin} is both sure and unsure about '
-                            f'{tag}. Assuming unsure.')
-                sure.pop(tag, None)
-
-        # Override the config so that set_tags always wins
-        if e.plugin == 'set_tags':
-            for tag in sure:
-                papier.config['autotag']['priority'][tag] = 'set_tags'
-
-        # Handle conflicts between plugins, tag by tag
-        for tag in sure | unsure:
-            if tag in tags | choices:
+        return None
+    return (path, doc.sha256sum())
+
+
+def load(item: tuple[str, str], ocr: Any) -> tuple[str, str, str, list]:
+    """ocr stage: runs OCR and text extraction, possibly in a worker
+    process. The temporary file is handed over to the next stage"""
+    path, sha256sum = item
+    log.info(f'loading {path}')
+    doc = papier.Document.from_import(path, ocr)
+    doc.sha256sum_ = sha256sum
+    try:
+        extracted = doc.extracted()
+    except BaseException:
+        # Delete the OCRed copy
+        doc.close()
+        raise
+    tmpfile = doc.tmpfile
+    # The next stage takes ownership of tmpfile
+    doc.owned_ = False
+    doc.close()
+    return (path, sha256sum, tmpfile, extracted)
+
+
+def merge(e: papier.extractor.Extractor, sure: dict[str, Any],
+          unsure: dict[str, Any], confidence: dict[str, float],
+          tags: dict[str, Any], choices: dict[str, Any],
+          confidences: dict[str, tuple[float, papier.extractor.Extractor]]
+          ) -> None:
+    """Merge the result of the extractor e in tags and choices, and the
+    confidence of its sure values, along with e, in confidences. The
+    result does not depend on the order the extractors are merged in"""
+    # Handle faulty plugins
+    for tag in unsure:
+        if tag in sure:
+            log.warning(f'{e.plugin} is both sure and unsure about '
+                        f'{tag}. Assuming unsure.')
+            sure.pop(tag, None)
+
+    # Override the config so that set_tags always wins
+    if e.plugin == 'set_tags':
+        for tag in sure:
+            papier.config['autotag']['priority'][tag] = 'set_tags'
+
+    # Handle conflicts between plugins, tag by tag. The most confident
+    # final value wins, then the priorities decide
+    threshold = papier.config['autotag']['confidence'].get(float)
+    for tag in sure | unsure:
+        if tag in tags | choices:
+            old, other = confidences.get(tag, (-1.0, None))
+            new = confidence.get(tag, -1.0) if tag in sure else -1.0
+            if max(old, new) >= threshold and old != new:
+                replace = new > old
+            else:
                 try:
                     prio = papier.config['autotag']['priority'][tag].get()
-                    if e.plugin == prio:
-                        tags.pop(tag, None)
-                        choices.pop(tag, None)
-                    else:
-                        sure.pop(tag, None)
-                        unsure.pop(tag, None)
                 except confuse.ConfigError:
                     raise papier.ConfigError(
                             f'"{e.plugin}" is trying to overwrite "{tag}". '
                             f'Please specify config.autotag.priority.{tag}'
                             )
-
-        # Merge the results
-        tags |= sure
-        choices |= unsure
-
-    log.info(f'tags: {tags}')
-    log.info(f'choices: {choices}')
+                if old >= threshold and prio not in (e.plugin,
+                                                     other.plugin):
+                    raise papier.ConfigError(
+                            f'"{e.plugin}" and "{other.plugin}" are both '
+                            f'sure about "{tag}". Please specify '
+                            f'config.autotag.priority.{tag}')
+                replace = (e.plugin == prio)
+            if replace:
+                tags.pop(tag, None)
+                choices.pop(tag, None)
+                confidences.pop(tag, None)
+            else:
+                sure.pop(tag, None)
+                unsure.pop(tag, None)
+
+    # Merge the results
+    tags |= sure
+    choices |= unsure
+    confidences |= {tag: (c, e) for tag, c in confidence.items()
+                    if tag in sure}
+
+
+def final(e: papier.extractor.Extractor, tags: dict[str, Any],
+          confidences: dict[str, tuple[float, papier.extractor.Extractor]],
+          before: set[str]) -> bool:
+    """returns whether the tags e produces all have final values, merged
+    from the extractors named in before, so that e may be skipped. Only
+    the extractors e depends on are always merged by the time it starts:
+    the others would make skipping e depend on the thread timings"""
+    threshold = papier.config['autotag']['confidence'].get(float)
+    return bool(e.produces) and all(
+            tag in tags and tag in confidences
+            and confidences[tag][0] >= threshold
+            and confidences[tag][1].name in before
+            for tag in e.produces)
+
+
+def needed_tags() -> set[str] | None:
+    """returns the tags to extract: the required ones, the ones organize
+    uses when the files are copied, and import.tags. None if every tag
+    should be extracted"""
+    tags = set(papier.config['import']['tags'].get(list))
+    if 'all' in tags:
+        return None
+    tags |= set(papier.config['import']['require'].get(list))
+    if papier.config['import']['copy'].get(bool):
+        # organize handles the 'imported' event, declared here
+        import papier.plugin.organize as organize
+        tags |= organize.variables()
+    return tags
+
+
+def extract_split(e: papier.extractor.Extractor,
+                  pairs: list[tuple[papier.Document, dict[str, Any]]]
+                  ) -> list[tuple[dict[str, Any], dict[str, Any],
+                                  dict[str, float]]]:
+    """returns the (sure, unsure, confidence) results of e on the pairs,
+    the values reported as a TagValue being split from their confidence
+    """
+    res = []
+    for sure, unsure in e.extract_many(pairs):
+        sure, confidence = papier.tags.split(sure)
+        unsure, _ = papier.tags.split(unsure)
+        res.append((sure, unsure, confidence))
+    return res
+
+
+def extract_cached(e: papier.extractor.Extractor,
+                   pairs: list[tuple[papier.Document, dict[str, Any]]]
+                   ) -> list[tuple[dict[str, Any], dict[str, Any],
+                                   dict[str, float]]]:
+    """returns the (sure, unsure, confidence) results of e on the pairs.
+    Results computed by the same version of e, with the same config and
+    inputs, are read from the library instead"""
+    if not pairs:
+        return []
+    if not papier.config['import']['cache'].get(bool) or e.version is None:
+        return extract_split(e, pairs)
+    settings = e.settings()
+    keys = [(doc.sha256sum(), e.name, e.version, settings, e.inputs(tags))
+            for doc, tags in pairs]
+    known = papier.library.results(keys)
+    missing = [i for i, key in enumerate(keys) if key not in known]
+    if missing:
+        log.info(f'running {e.name} on {len(missing)} documents')
+        computed = extract_split(e, [pairs[i] for i in missing])
+        done = [(keys[i], res) for i, res in zip(missing, computed)]
+        if not papier.config['dry_run'].get(bool):
+            papier.library.set_results(done)
+        known.update(done)
+    # The same document may show up twice, and merge() alters results
+    return [tuple(dict(column) for column in known[key]) for key in keys]
+
+
+def extract(items: list[tuple[str, str, str, list]],
+            needed: set[str] | None = None, dropped: set[str] | None = None
+            ) -> list[tuple[papier.Document, dict] | None]:
+    """extract stage: returns the documents and their tags, or None for
+    the documents that should not be imported, whose paths are added to
+    dropped. The documents go through the extractors together, so that
+    batch extractors process them at once. Only the extractors needed to
+    produce the needed tags run (all of them if None)"""
+    hide_progress = (not papier.config['progress'].get(bool))
+    docs = []
+    for path, sha256sum, tmpfile, extracted in items:
+        doc = papier.Document.from_tmpfile(path, tmpfile, extracted)
+        doc.sha256sum_ = sha256sum
+        docs.append(doc)
+    tags = [dict() for doc in docs]
+    choices = [dict() for doc in docs]
+    confidences = [dict() for doc in docs]
+
+    def start(e: papier.extractor.Extractor) -> Callable:
+        # The extractor may run while the results of others are merged:
+        # it gets the tags known so far, for the documents where it may
+        # change them
+        todo = []
+        for i, (doc, t, conf) in enumerate(zip(docs, tags, confidences)):
+            if final(e, t, conf, before[e.name]):
+                log.info(f'skipping {e.name} on {doc.path}: '
+                         f'{e.produces} already known')
+            else:
+                todo.append(i)
+        pairs = [(docs[i], dict(tags[i])) for i in todo]
+
+        def run() -> list:
+            res = [({}, {}, {}) for doc in docs]
+            for i, r in zip(todo, extract_cached(e, pairs)):
+                res[i] = r
+            return res
+        return run
+
+    extractors = papier.extractors
+    if needed is not None:
+        extractors = papier.extractor.needed(extractors, needed)
+    before = {e.name: {extractors[j].name for j in deps}
+              for e, deps in zip(extractors,
+                                 papier.extractor.ancestors(extractors))}
+    threads = papier.config['import']['extractor_threads'].get(int)
+    progressbar = tqdm.tqdm(total=len(extractors), disable=hide_progress)
+    for e, results in papier.extractor.run(extractors, start, threads):
+        if len(docs) == 1:
+            progressbar.set_description(f'[{docs[0].path}] {e.plugin}')
+        else:
+            progressbar.set_description(f'[{len(docs)} files] {e.plugin}')
+        progressbar.update()
+
+        for (sure, unsure, confidence), t, c, conf in zip(
+                results, tags, choices, confidences):
+            merge(e, sure, unsure, confidence, t, c, conf)
+    progressbar.close()
 
     required = papier.config['import']['require'].get(list)
 
-    # filter out non required tags
-    unwanted = set(choices) - set(required)
-    for k in unwanted:
-        del choices[k]
+    res = []
+    for doc, t, c in zip(docs, tags, choices):
+        log.info(f'tags: {t}')
+        log.info(f'choices: {c}')
+
+        # filter out non required tags
+        unwanted = set(c) - set(required)
+        for k in unwanted:
+            del c[k]
+
+        # TODO: add a procedure to choose when unsure
+        if c:
+            log.info(f'Missing tags: {list(c.keys())}')
+
+        if all([tag in t for tag in required]):
+            res.append((doc, t))
+        else:
+            if dropped is not None:
+                dropped.add(doc.path)
+            doc.close()
+            res.append(None)
+    return res
+
+
+def store(items: list[tuple[papier.Document, dict]]) -> list[None]:
+    """store stage: organizes the documents and adds them to the library,
+    all at once, in a single transaction. The handlers of the 'imported'
+    event run before it, so that the library is not locked while files
+    are copied. The documents handled before a failure are still added,
+    and the stage drains: when the import stops, the documents waiting
+    for it are still stored"""
+    stored = []
+    seen = set()
+    with contextlib.ExitStack() as stack:
+        try:
+            for doc, tags in items:
+                stack.enter_context(doc)
+                # The same content may have been queued twice
+                if doc.sha256sum() in seen or papier.library.has(doc):
+                    log.info(f'skipping {doc.path}')
+                    continue
+                seen.add(doc.sha256sum())
+                log.info(f'All required tags are set for {doc}, adding to '
+                         'library')
+                papier.send_event('imported', doc, tags)
+                stored.append((doc, tags))
+        finally:
+            if stored and not papier.config['dry_run'].get(bool):
+                papier.library.upsert_many(stored)
+    return [None for item in items]
 
-    # TODO: add a procedure to choose when unsure
-    if choices:
-        log.info(f'Missing tags: {list(choices.keys())}')
 
-    if all([tag in tags for tag in required]):
-        log.info(f'All required tags are set for {doc}, adding to library')
-        if not papier.config['dry_run'].get(bool):
-            papier.library.add(doc, tags)
-        papier.send_event('imported', doc, tags)
+def process(path: str) -> None:
+    """Run all the import stages on a single file"""
+    log.info(f'processing {path}')
+    needed = needed_tags()
+    papier.plugins.load_extractors(needed)
+    ocr = papier.config['import']['ocr'].get()
+    item = checksum(path)
+    if item is not None:
+        item = extract([load(item, ocr)], needed)[0]
+    if item is not None:
+        store([item])
+
+
+def label(item: Any) -> str:
+    """returns the path of the file an item of the import stages is
+    about: a path, a tuple starting with it, or (document, tags)"""
+    if isinstance(item, str):
+        return item
+    if isinstance(item[0], papier.Document):
+        return item[0].path
+    return item[0]
+
+
+def discard(item: Any, dropped: set[str] | None = None) -> None:
+    """Release an item of the import stages which will not be imported,
+    deleting its temporary file, and add its path to dropped"""
+    if dropped is not None:
+        dropped.add(label(item))
+    if isinstance(item, str):
+        return
+    if isinstance(item[0], papier.Document):
+        item[0].close()
+    elif len(item) == 4:
+        path, sha256sum, tmpfile, extracted = item
+        papier.Document.from_tmpfile(path, tmpfile, extracted).close()
+
+
+def stages(dropped: set[str] | None = None) -> list[Stage]:
+    """returns the import stages, as configured. The paths of the files
+    which are not imported (missing required tags, or failing) are added
+    to dropped.
+
+    A file failing in a stage is logged and dropped, and the others go
+    on. Config errors stop the import: the documents done by then are
+    still stored"""
+    needed = needed_tags()
+    papier.plugins.load_extractors(needed)
+    jobs = papier.config['import']['jobs'].get(int)
+    ocr = papier.config['import']['ocr'].get()
+    flush = papier.config['import']['flush']
+
+    def workers(stage: str) -> int:
+        n = papier.config['import']['workers'][stage].get()
+        if n is None:
+            n = jobs
+        if not isinstance(n, int) or n < 1:
+            raise papier.ConfigError(
+                    f'import.workers.{stage}={n}: expected a positive '
+                    'integer')
+        return n
+
+    errors = {'errors': (Exception,), 'fatal': (papier.ConfigError,),
+              'discard': functools.partial(discard, dropped=dropped),
+              'label': label}
+    # OCR is CPU bound and ocrmypdf is not thread safe: use processes
+    return [
+        Stage('hash', checksum, workers('hash'), **errors),
+        Stage('ocr', functools.partial(load, ocr=ocr), workers('ocr'),
+              processes=workers('ocr') > 1, **errors),
+        Stage('extract', functools.partial(extract, needed=needed,
+                                           dropped=dropped),
+              workers('extract'),
+              batch_size=papier.config['import']['batch_size'].get(int),
+              **errors),
+        # Single writer for the library and the organized directory,
+        # committing batches of documents, even when the import stops
+        Stage('store', store, batch_size=flush['documents'].get(int),
+              batch_wait=flush['seconds'].as_number(), drain=True,
+              **errors),
+        ]
 
 
 def tag(path: str,
         tags: dict[str, str] = {"/Author": "Christophe-Marie Duquesne"}
         ) -> str:
+    # Slow to import, and only needed here
+    from pypdf import PdfReader, PdfWriter
     with TempFile(dir='.', delete=False) as tmp:
         reader = PdfReader(path)
 
@@ -170,9 +500,20 @@ def split_pair(tag_pair: str) -> tuple[str, str]:
         add_argument('--set', action='append',
                      help='Set the given tag to the given value',
                      default=argparse.SUPPRESS),
+        add_argument('--tags', action='append',
+                     help='Also extract the given tag (all: every tag)',
+                     default=argparse.SUPPRESS),
         add_argument('--autotag', action=argparse.BooleanOptionalAction,
                      help='Automatically tag the files',
                      default=argparse.SUPPRESS),
+        add_argument('--rescan', action='store_true',
+                     help='Also scan the directories unchanged since the '
+                     'last import',
+                     default=False),
+        add_argument('-j', '--jobs', type=int,
+                     help='Number of files processed in parallel by the '
+                     'CPU heavy stages',
+                     default=argparse.SUPPRESS),
         command_name='import')
 def run(args: List[Any]) -> None:
     if hasattr(args, 'set'):
@@ -181,6 +522,21 @@ def run(args: List[Any]) -> None:
             papier.config['import']['set'][tag_key].set(tag_value)
         del args.__dict__['set']
 
+    rescan = args.rescan
+    del args.__dict__['rescan']
+
     papier.config['import'].set_args(args)
-    for p in find_pdfs(args.path):
-        process(p)
+    queue_size = papier.config['import']['queue_size'].get(int)
+
+    known = {} if rescan else papier.library.watermarks()
+    seen = dict()
+    dropped = set()
+    Pipeline(stages(dropped), queue_size).run(
+            find_pdfs(args.path, known, seen))
+
+    # Only remember the directories once all their files are stored, so
+    # that the files dropped are tried again on the next import
+    for path in dropped:
+        seen.pop(os.path.dirname(os.path.abspath(path)), None)
+    if not papier.config['dry_run'].get(bool):
+        papier.library.set_watermarks(seen)
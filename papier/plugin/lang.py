@@ -1,4 +1,5 @@
 import papier
+import papier.models
 from typing import Any
 import spacy
 import spacy_fastlang   # noqa: F401 # pylint: disable=unused-import
@@ -8,10 +9,18 @@ import fasttext
 fasttext.FastText.eprint = lambda x: None
 
 
-@papier.extracts(produces=['lang'])
-def extract_lang(document: papier.Document, tags: dict[str, Any]
-                 ) -> tuple[dict[str, Any], dict[str, Any]]:
+def detector() -> spacy.language.Language:
     nlp = spacy.load('en_core_web_sm')
     nlp.add_pipe('language_detector')
-    doc = nlp(document.text)
-    return ({'lang': doc._.language}, {})
+    return nlp
+
+
+# The beginning and the end of a document tell its language
+@papier.extracts(produces=['lang'], batch=True,
+                 budget=papier.Budget(chars=2000, tail=1000))
+def extract_lang(pairs: list[tuple[papier.Document, dict[str, Any]]]
+                 ) -> list[tuple[dict[str, Any], dict[str, Any]]]:
+    nlp = papier.models.get(detector, 'en_core_web_sm',
+                            config={'pipes': ['language_detector']})
+    docs = papier.models.pipe(nlp, (document.text for document, _ in pairs))
+    return [({'lang': doc._.language}, {}) for doc in docs]
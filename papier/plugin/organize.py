@@ -1,12 +1,13 @@
 import papier
-from papier.cli.commands import command
+import papier.files as files
+from papier.cli.commands import command, add_argument
 from typing import Any
 import jinja2
+import jinja2.meta
 import jinja2.sandbox
 import re
 import os.path
 import logging
-import shutil
 
 # Logger for this plugin
 log = logging.getLogger(__name__)
@@ -20,6 +21,23 @@ env = jinja2.sandbox.SandboxedEnvironment()
 env.filters['match'] = match
 
 
+def condition(statement: str) -> str:
+    """returns a template rendering as 'True' when statement holds"""
+    return ('{% if ' + f'{statement}' + ' %}'
+            'True{% else %}False{% endif %}')
+
+
+def variables() -> set[str]:
+    """returns the tags the organize rules refer to"""
+    res = set()
+    for rule in papier.config['organize'].get(list):
+        templates = [condition(s) for s in rule.get('when', [])]
+        templates.append(rule['path'])
+        for template in templates:
+            res |= jinja2.meta.find_undeclared_variables(env.parse(template))
+    return res
+
+
 def desired_path(document: papier.Document, tags: dict[str, str]) -> str:
     rules = papier.config['organize'].get(list)
     for rule in rules:
@@ -32,8 +50,7 @@ def desired_path(document: papier.Document, tags: dict[str, str]) -> str:
             conditions = []
             for statement in when:
                 # every statement should render as 'True'
-                template = ('{% if ' + f'{statement}' + ' %}'
-                            'True{% else %}False{% endif %}')
+                template = condition(statement)
                 rendered = env.from_string(template).render(**tags)
                 conditions.append(rendered.strip() == 'True')
             proceed = all(conditions)
@@ -69,11 +86,11 @@ def organize(document: papier.Document, tags: dict[str, str]) -> None:
     dirname = os.path.dirname(dest)
     if not os.path.exists(dirname):
         os.makedirs(dirname)
-    shutil.copy(document.tmpfile, dest)
+    # A private temporary file can be linked rather than copied
+    files.clone(document.tmpfile, dest, link=document.owns_tmpfile())
 
-    # Update the path of the document in the library
+    # The importer stores the document with its new path
     document.path = os.path.join(libdir, dest)
-    papier.library.update(document)
 
 
 def on_imported(document: papier.Document, tags: dict) -> None:
@@ -85,8 +102,29 @@ def on_imported(document: papier.Document, tags: dict) -> None:
 papier.set_event_handler('imported', on_imported)
 
 
+# A condition on a tag, as given on the command line
+WHERE = re.compile(r'(?P<key>[^=!<>]+)(?P<op>!=|<=|>=|=|<|>)(?P<value>.*)')
+
+
+def parse_where(arg: str) -> tuple[str, str, str]:
+    """returns the (key, operator, value) of a <key><operator><value>
+    condition"""
+    m = WHERE.fullmatch(arg)
+    if m is None:
+        raise papier.CommandError(
+                f'Wrong argument for --where: {arg}, expected '
+                '<key><operator><value>, e.g. date>=2023-01-01')
+    return m['key'].strip(), m['op'], m['value'].strip()
+
+
 # TODO actually organize, not list
-@command(command_name='list')
+@command(
+        add_argument('--where', action='append', default=[],
+                     help='Only list the documents whose tag satisfies '
+                     'the condition (=, !=, <, <=, >, >=), e.g. '
+                     'date>=2023-01-01'),
+        command_name='list')
 def run(args: list[Any]) -> None:
-    for doc, tags in papier.library.list():
+    conditions = [parse_where(arg) for arg in args.where]
+    for doc, tags in papier.library.list(conditions):
         print(doc, tags)
@@ -6,8 +6,10 @@ from typing import Any
 def read_tags(document: papier.Document, tags: dict[str, Any]
               ) -> tuple[dict[str, Any], dict[str, Any]]:
     """Extract the tags already present in the document, removing the
-    prepended '/' and turning the key to lowercase"""
-    meta = document.pdfreader.metadata
+    prepended '/' and turning the key to lowercase. They were set on
+    purpose, so they are reported as certain"""
+    with document.lock_:
+        meta = document.pdfreader.metadata or {}
 
     res = {}
     for key, value in meta.items():
@@ -15,6 +17,6 @@ def read_tags(document: papier.Document, tags: dict[str, Any]
         if key.startswith('/'):
             converted_key = key[1:].lower()
         if converted_key != '':
-            res[converted_key] = value
+            res[converted_key] = papier.TagValue(value, confidence=1.0)
 
     return (res, {})
@@ -0,0 +1,34 @@
+"""plugin to search the text of the library"""
+import papier
+import papier.library
+from papier.cli.commands import command, add_argument
+from typing import List, Any
+
+
+def split_tag(tag_pair: str) -> tuple[str, str]:
+    """splits the input string at the first equals sign"""
+    key, sep, value = tag_pair.partition('=')
+    if not sep:
+        raise papier.CommandError(
+                'Wrong argument for --tag: expected <key>=<value>')
+    return key, value
+
+
+@command(
+        add_argument('query', nargs='+',
+                     help='words to search (FTS5 query syntax)'),
+        add_argument('--tag', action='append', default=[],
+                     help='Only show the documents with the given '
+                     '<key>=<value> tag'),
+        add_argument('--limit', type=int, default=20,
+                     help='Maximal number of documents to show'),
+        command_name='search')
+def run(args: List[Any]) -> None:
+    """search the text of the documents of the library"""
+    tags = dict(split_tag(tag) for tag in args.tag)
+    query = ' '.join(args.query)
+    results = papier.library.search(query, tags, args.limit)
+    for doc, doc_tags, snippet in results:
+        print(f'{doc.path} {doc_tags}')
+        # One line per document
+        print(f'    {" ".join(snippet.split())}')
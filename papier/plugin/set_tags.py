@@ -3,10 +3,12 @@ import confuse
 from typing import Any
 
 
-@papier.extracts()
+@papier.extracts(config=['import.set'])
 def set_tags(document: papier.Document, tags: dict[str, Any]
              ) -> tuple[dict[str, Any], dict[str, Any]]:
     try:
-        return (papier.config['import']['set'].get(dict), {})
+        tags = papier.config['import']['set'].get(dict)
+        return ({tag: papier.TagValue(value, confidence=1.0)
+                 for tag, value in tags.items()}, {})
     except confuse.ConfigError:
         return ({}, {})
@@ -0,0 +1,241 @@
+"""continuously import the pdfs dropped in inbox directories"""
+import papier
+import papier.plugin.importer as importer
+from papier.cli.commands import command, add_argument
+from argcomplete.completers import DirectoriesCompleter
+import argparse
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+from typing import Self, List, Any
+
+
+# Logger for this plugin
+log = logging.getLogger(__name__)
+
+
+# Constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+# Events we watch for
+MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# struct inotify_event, without the trailing name
+EVENT = struct.Struct('iIII')
+
+
+class Inotify():
+    """Minimal binding to the Linux inotify API. Raises OSError when
+    inotify is not available"""
+
+    def __init__(self: Self) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        try:
+            self._add_watch = libc.inotify_add_watch
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except AttributeError:
+            raise OSError('inotify is not supported on this platform')
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.fd = fd
+        # Map watch descriptor -> watched directory
+        self.watches: dict[int, str] = {}
+
+    def add_watch(self: Self, path: str) -> None:
+        wd = self._add_watch(self.fd, os.fsencode(path), MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        self.watches[wd] = path
+
+    def read(self: Self, timeout: float) -> list[tuple[str, int]]:
+        """Waits at most timeout seconds for events. Returns them as
+        (path, mask) pairs. On queue overflow, path is None"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        i = 0
+        while i < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, i)
+            name = data[i + EVENT.size:i + EVENT.size + length]
+            i += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+            elif mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+            elif wd in self.watches:
+                name = os.fsdecode(name.rstrip(b'\0'))
+                events.append((os.path.join(self.watches[wd], name), mask))
+        return events
+
+    def close(self: Self) -> None:
+        os.close(self.fd)
+
+
+def signature(path: str) -> tuple[int, float] | None:
+    """returns what tells that a file is still being written"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime)
+
+
+class Watcher():
+    """Finds the pdfs in the inboxes and imports them once they stay
+    unchanged for settle seconds"""
+
+    def __init__(self: Self, inboxes: list[str], settle: float,
+                 interval: float, poll: bool = False) -> None:
+        self.inboxes = inboxes
+        self.settle = settle
+        self.interval = interval
+        self.inotify = None
+        if not poll:
+            try:
+                self.inotify = Inotify()
+            except OSError as e:
+                log.warning(f'cannot use inotify ({e}), polling instead')
+        # Map path -> (signature, time since which it is unchanged)
+        self.pending: dict[str, tuple[tuple[int, float], float]] = {}
+        # When polling, map path -> signature of the files already seen
+        self.seen: dict[str, tuple[int, float]] = {}
+
+    def watch(self: Self, root: str) -> None:
+        """Watch root and all its subdirectories"""
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            try:
+                self.inotify.add_watch(directory)
+                with os.scandir(directory) as it:
+                    stack.extend(e.path for e in it if e.is_dir())
+            except OSError as e:
+                log.warning(f'cannot watch {directory}: {e}')
+
+    def add(self: Self, path: str) -> None:
+        """Start waiting for path to settle"""
+        sig = signature(path)
+        if sig is None:
+            return
+        if path in self.pending and self.pending[path][0] == sig:
+            return
+        if self.inotify is None and self.seen.get(path) == sig:
+            return
+        self.pending[path] = (sig, time.monotonic())
+
+    def scan(self: Self, root: str) -> None:
+        for path in importer.find_pdfs(root):
+            self.add(path)
+
+    def rescan(self: Self) -> None:
+        """Look for pdfs in all the inboxes"""
+        if self.inotify is None:
+            # Forget the files that disappeared
+            present = set()
+            for root in self.inboxes:
+                present.update(importer.find_pdfs(root))
+            self.seen = {p: s for p, s in self.seen.items() if p in present}
+        for root in self.inboxes:
+            self.scan(root)
+
+    def handle(self: Self, path: str | None, mask: int) -> None:
+        if path is None:
+            log.warning('inotify queue overflow, rescanning the inboxes')
+            self.rescan()
+        elif mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                # Files may have been written before the watch was set
+                self.watch(path)
+                self.scan(path)
+        elif importer.PDF.match(path):
+            self.add(path)
+
+    def ready(self: Self) -> list[str]:
+        """returns the pending files that did not change for settle
+        seconds"""
+        res = []
+        now = time.monotonic()
+        for path, (sig, since) in [i for i in self.pending.items()]:
+            current = signature(path)
+            if current is None:
+                del self.pending[path]
+            elif current != sig:
+                self.pending[path] = (current, now)
+            elif now - since >= self.settle:
+                del self.pending[path]
+                if self.inotify is None:
+                    self.seen[path] = sig
+                res.append(path)
+        return res
+
+    def run(self: Self) -> None:
+        if self.inotify is not None:
+            for root in self.inboxes:
+                self.watch(root)
+        self.rescan()
+        last_scan = time.monotonic()
+        tick = min(self.settle, self.interval, 1.0)
+        try:
+            while True:
+                if self.inotify is not None:
+                    for path, mask in self.inotify.read(tick):
+                        self.handle(path, mask)
+                else:
+                    time.sleep(tick)
+                    if time.monotonic() - last_scan >= self.interval:
+                        self.rescan()
+                        last_scan = time.monotonic()
+                for path in self.ready():
+                    try:
+                        importer.process(path)
+                    except Exception as e:
+                        log.error(f'failed to import {path}: {e}')
+        finally:
+            if self.inotify is not None:
+                self.inotify.close()
+
+
+@command(
+        add_argument('path', nargs='+', help='inbox directories to watch',
+                     completer=DirectoriesCompleter()),
+        add_argument('--poll', action='store_true',
+                     help='Poll the inboxes instead of using inotify',
+                     default=False),
+        add_argument('--settle', type=float,
+                     help='Seconds a file must stay unchanged before it '
+                     'gets imported',
+                     default=argparse.SUPPRESS),
+        add_argument('--interval', type=float,
+                     help='Seconds between two scans when polling',
+                     default=argparse.SUPPRESS),
+        command_name='watch')
+def run(args: List[Any]) -> None:
+    """import the pdfs dropped in the inboxes, as they arrive"""
+    papier.config['watch'].set_args(args)
+    conf = papier.config['watch']
+    watcher = Watcher(args.path, conf['settle'].as_number(),
+                      conf['interval'].as_number(), args.poll)
+    log.info(f'watching {args.path}')
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
@@ -1,11 +1,24 @@
-"""Support for papier plugins"""
+"""Support for papier plugins.
 
+Importing a plugin may be slow (NLP models, OCR...), so plugins are only
+imported when needed: when their command runs, when one of their
+extractors is needed, or when an event they handle is sent. What each
+plugin provides is recorded in a manifest the first time it is
+imported, and cached until the plugin changes."""
+
+import papier
 import papier.errors
 import logging
 import traceback
 import importlib
+import importlib.util
+import json
+import os
+import os.path
+import tempfile
 from collections import defaultdict
-from typing import Any, Callable
+from types import SimpleNamespace
+from typing import Any, Callable, Iterable
 
 
 # Global logger
@@ -20,17 +33,66 @@ _event_handlers = defaultdict(set)
 _event_descriptions = defaultdict(str)
 
 
-def declare_event(event: str, description: str) -> None:
+# What each plugin provides, as recorded when it was imported:
+# plugin -> {'commands': {name: help}, 'events': {name: description},
+#            'handlers': [event], 'extractors': [{'produces': [tag],
+#                                                 'consumes': [tag]}]}
+_manifest: dict[str, dict[str, Any]] = {}
+
+# Plugins available, in loading order
+_available: list[str] = []
+
+# Plugins imported so far
+_loaded: set[str] = set()
+
+# Modules of the plugins being imported, innermost last
+_importing: list[str] = []
+
+
+def plugin_name(module: str) -> str | None:
+    """returns the name of the plugin defined in module, if any"""
+    prefix = 'papier.plugin.'
+    if module.startswith(prefix):
+        return module[len(prefix):]
+    return None
+
+
+def provide(module: str, kind: str, item: Any, value: Any = None) -> None:
+    """Record in the manifest that the module provides item (a command,
+    an event, a handler or an extractor)"""
+    plugin = plugin_name(module)
+    if plugin is None:
+        return
+    entry = _manifest.setdefault(plugin, {'commands': {}, 'events': {},
+                                          'handlers': [], 'extractors': []})
+    if isinstance(entry[kind], dict):
+        entry[kind][item] = value
+    elif item not in entry[kind]:
+        entry[kind].append(item)
+
+
+def declare_event(event: str, description: str, module: str = None
+                  ) -> None:
+    """Declare an event, which plugins may then handle. module (its
+    __name__) is the module declaring it, by default the plugin being
+    imported"""
     if event in _event_descriptions:
         raise papier.PluginError(f'Event "{event}" already declared')
     _event_descriptions[event] = description
+    if module is None:
+        module = _importing[-1] if _importing else ''
+    provide(module, 'events', event, description)
 
 
 def set_event_handler(event: str, func: Callable) -> None:
     """Sets func to be called whenever the event is triggered"""
+    if event not in _event_descriptions:
+        # The plugin declaring the event may not be imported yet
+        load_providers('events', event)
     if event not in _event_descriptions:
         raise papier.PluginError(f'Event "{event}" is not declared')
     _event_handlers[event].add(func)
+    provide(func.__module__, 'handlers', event)
 
 
 def send_event(event: str, *args: tuple[Any], **kwds: dict[str, Any]
@@ -38,6 +100,7 @@ def send_event(event: str, *args: tuple[Any], **kwds: dict[str, Any]
     """Call all functions registered for the event"""
     if event not in _event_descriptions:
         raise papier.PluginError(f'Event "{event}" is not declared')
+    load_providers('handlers', event)
     log.info(f'Sending event: {event}')
     for func in _event_handlers[event]:
         log.info(f'Calling function: '
@@ -45,16 +108,154 @@ def send_event(event: str, *args: tuple[Any], **kwds: dict[str, Any]
         func(*args, **kwds)
 
 
-def load_plugins(plugins: list[str] = ()) -> None:
-    for plugin in plugins:
-        modname = f'papier.plugin.{plugin}'
+def manifest_path() -> str:
+    """returns where the manifest is cached, or '' if it is not"""
+    path = papier.config['plugin_manifest'].get()
+    if not path:
+        return ''
+    return os.path.expanduser(path)
+
+
+def stamp(plugin: str) -> list | None:
+    """returns what identifies the version of the plugin, or None if it
+    cannot be found"""
+    try:
+        spec = importlib.util.find_spec(f'papier.plugin.{plugin}')
+    except (ImportError, ValueError):
+        return None
+    if spec is None or not spec.origin or not os.path.isfile(spec.origin):
+        return None
+    st = os.stat(spec.origin)
+    return [papier.__version__, spec.origin, st.st_mtime_ns, st.st_size]
+
+
+def read_manifest() -> dict[str, Any]:
+    path = manifest_path()
+    if not path:
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(entries: dict[str, Any]) -> None:
+    path = manifest_path()
+    if not path:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+                'w', dir=os.path.dirname(path), delete=False) as f:
+            json.dump(entries, f)
+        os.replace(f.name, path)
+    except OSError as e:
+        log.warning(f'cannot write the plugin manifest {path}: {e}')
+
+
+def load_plugin(plugin: str) -> bool:
+    """Import the plugin, after the plugins declaring the events it
+    handles. Returns whether it could be imported"""
+    if plugin in _loaded:
+        return True
+    for event in _manifest.get(plugin, {}).get('handlers', []):
+        for other in _available:
+            if other != plugin and event in _manifest[other]['events']:
+                load_plugin(other)
+    modname = f'papier.plugin.{plugin}'
+    try:
+        log.info(f'loading plugin {plugin}')
+        _importing.append(modname)
         try:
-            log.info(f'loading plugin {plugin}')
             importlib.import_module(modname)
-        except ModuleNotFoundError:
-            log.warning(f'** plugin {plugin} not found')
-        except Exception:
-            log.warning(
-                    f'** error loading plugin "{plugin}":\n'
-                    f'{traceback.format_exc()}'
-                    )
+        finally:
+            _importing.pop()
+    except ModuleNotFoundError:
+        log.warning(f'** plugin {plugin} not found')
+        return False
+    except Exception:
+        log.warning(
+                f'** error loading plugin "{plugin}":\n'
+                f'{traceback.format_exc()}'
+                )
+        return False
+    _loaded.add(plugin)
+    return True
+
+
+def load_plugins(plugins: list[str] = ()) -> None:
+    for plugin in plugins:
+        load_plugin(plugin)
+
+
+def scan_plugins(plugins: list[str] = ()) -> None:
+    """Make the plugins available, without importing them when the
+    manifest tells what they provide"""
+    cached = read_manifest()
+    updated = False
+    for plugin in plugins:
+        if plugin in _available:
+            continue
+        current = stamp(plugin)
+        entry = cached.get(plugin)
+        if current is not None and entry and entry['stamp'] == current:
+            _manifest[plugin] = entry
+        else:
+            if not load_plugin(plugin):
+                continue
+            entry = _manifest.setdefault(plugin, {
+                'commands': {}, 'events': {}, 'handlers': [],
+                'extractors': []})
+            entry['stamp'] = current
+            cached[plugin] = entry
+            updated = updated or current is not None
+        _available.append(plugin)
+    if updated:
+        write_manifest(cached)
+
+
+def commands() -> list[tuple[str, str, str]]:
+    """returns the (plugin, command, help) of the available plugins"""
+    return [(plugin, name, help)
+            for plugin in _available
+            for name, help in _manifest[plugin]['commands'].items()]
+
+
+def providers(kind: str, item: Any = None) -> list[str]:
+    """returns the available plugins providing something of the kind
+    (or item, if given)"""
+    return [plugin for plugin in _available
+            if _manifest[plugin][kind]
+            and (item is None or item in _manifest[plugin][kind])]
+
+
+def load_providers(kind: str, item: Any = None) -> None:
+    """Import the available plugins providing something of the kind (or
+    item, if given)"""
+    load_plugins(providers(kind, item))
+
+
+def load_extractors(tags: Iterable[str] | None = None) -> None:
+    """Import the available plugins providing extractors (only the ones
+    needed to produce tags, if given), and check how their extractors
+    depend on each other"""
+    loaded = len(_loaded)
+    plugins = providers('extractors')
+    if tags is not None:
+        # What the extractors of each plugin need and produce, together
+        extractors = []
+        for plugin in plugins:
+            entries = _manifest[plugin]['extractors']
+            produces = [t for e in entries for t in e['produces']]
+            if not all(e['produces'] for e in entries):
+                # Produces any tag
+                produces = []
+            extractors.append(SimpleNamespace(
+                plugin=plugin, produces=produces,
+                consumes=[t for e in entries for t in e['consumes']]))
+        plugins = [e.plugin
+                   for e in papier.extractor.needed(extractors, tags)]
+    load_plugins(plugins)
+    if len(_loaded) != loaded:
+        papier.extractor.check()
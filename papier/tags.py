@@ -6,9 +6,11 @@ from dataclasses import dataclass, field
 
 @dataclass
 class TagValue():
+    """A value an extractor reports along with its confidence, between 0
+    and 1 (-1: unknown)"""
     value: Any
     type: str = field(default='category', init=False)
-    confidence: float = field(default=-1.0, init=False)
+    confidence: float = -1.0
 
     def __hash__(self: Self) -> int:
         return hash(self.value) + hash(self.type)
@@ -24,3 +26,15 @@ class TagValue():
 
 
 Tags = UserDict[str, TagValue]
+
+
+def split(tags: dict[str, Any]) -> tuple[dict[str, Any], dict[str, float]]:
+    """returns the values of tags, and the confidence of the ones given
+    as a TagValue"""
+    values, confidence = {}, {}
+    for tag, value in tags.items():
+        if isinstance(value, TagValue):
+            confidence[tag] = value.confidence
+            value = value.value
+        values[tag] = value
+    return values, confidence
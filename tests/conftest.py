@@ -0,0 +1,41 @@
+import papier
+import pathlib
+import pytest
+import confuse
+from papier.library import Library
+from typing import Callable, Iterable, Iterator
+
+
+@pytest.fixture
+def config(monkeypatch: pytest.MonkeyPatch) -> confuse.Configuration:
+    """papier.config, restored at the end of the test"""
+    monkeypatch.setattr(papier.config, 'sources',
+                        list(papier.config.sources))
+    return papier.config
+
+
+@pytest.fixture
+def library(tmp_path: pathlib.Path) -> Iterator[Library]:
+    """an empty library in tmp_path, closed at the end of the test"""
+    library = Library(str(tmp_path / 'library.sqlite'))
+    library.init()
+    yield library
+    library.close()
+
+
+@pytest.fixture
+def make_docs() -> Callable[[int, Iterable[str]], list[papier.Document]]:
+    """returns a function making n documents with distinct checksums and
+    the given texts ('text <i>' by default), without reading any file"""
+    def make_docs(n: int, texts: Iterable[str] = None
+                  ) -> list[papier.Document]:
+        if texts is None:
+            texts = [f'text {i}' for i in range(n)]
+        docs = []
+        for i, text in zip(range(n), texts):
+            doc = papier.Document(__file__)
+            doc.sha256sum_ = f'{i:064x}'
+            doc.text_ = text
+            docs.append(doc)
+        return docs
+    return make_docs
@@ -1,11 +1,15 @@
+import confuse
 import papier
 import papier.cli
 from unittest.mock import patch
 import sys
+import pathlib
 import pytest
 
 
-def test_version(capsys: pytest.CaptureFixture) -> None:
+def test_version(capsys: pytest.CaptureFixture, tmp_path: pathlib.Path,
+                 config: confuse.Configuration) -> None:
+    config['plugin_manifest'].set(str(tmp_path / 'manifest.json'))
     argv = ['papiers', 'version']
     with patch.object(sys, 'argv', argv):
         papier.cli.main()
@@ -0,0 +1,71 @@
+import datetime
+import random
+import dateparser.search
+import pytest
+from papier.plugin import date
+
+
+def corpus(n: int) -> list[tuple[str, str]]:
+    """returns n (text, lang), dense with things which look like dates"""
+    rng = random.Random(0)
+    words = {
+        'en': 'invoice total due the of and page EUR March Sept'.split(),
+        'fr': 'facture total échéance le du et page EUR janvier août'.split(),
+        'de': 'Rechnung Summe fällig am vom und Seite EUR März Dez'.split(),
+        }
+    res = []
+    for _ in range(n):
+        lang = rng.choice(list(words))
+        tokens = []
+        for _ in range(rng.randint(5, 40)):
+            day, month = rng.randint(1, 28), rng.randint(1, 12)
+            year = rng.choice([2019, 2023, 2031, 23])
+            tokens.append(rng.choice(words[lang] + [
+                f'{day:02d}/{month:02d}/{year}', f'{year}-{month:02d}-{day}',
+                f'{day}.{month}.{year}', f'{month}/{year}', f'{year}',
+                f'{rng.randint(1, 999)}.{rng.randint(0, 99):02d}',
+                str(rng.randint(10**9, 2 * 10**9))]))
+            tokens.append(rng.choice([' ', ' ', '\n', ', ', ': ', '. ']))
+        res.append((''.join(tokens), lang))
+    return res
+
+
+def test_first_date() -> None:
+    """test that searching the candidates finds the same date as
+    searching the whole text"""
+    ref = datetime.datetime(2025, 1, 1)
+    for text, lang in corpus(40):
+        found = dateparser.search.search_dates(
+                text, languages=[lang], settings=date.SETTINGS) or []
+        dates = [d for _, d in found if d <= ref]
+        expected = dates[0] if dates else None
+        assert date.first_date(text, lang, ref) == expected, text
+
+
+def test_first_date_memoized() -> None:
+    """test that pieces of text are only parsed once"""
+    date.search.cache_clear()
+    text = 'Invoice of 12 March 2031\nPaid: 3 March 2023\nTotal: 12.00'
+    ref = datetime.datetime(2025, 1, 1)
+    assert date.first_date(text, 'en', ref) == datetime.datetime(2023, 3, 3)
+    misses = date.search.cache_info().misses
+    assert date.first_date(text, 'en', ref) == datetime.datetime(2023, 3, 3)
+    assert date.search.cache_info().misses == misses
+
+
+def test_first_date_whole_text(monkeypatch: pytest.MonkeyPatch) -> None:
+    """test that whole texts are parsed, and not memoized, when the
+    pieces cannot be told apart"""
+    text = 'Invoice of 12 March 2031\nPaid: 3 March 2023\nTotal: 12.00'
+    ref = datetime.datetime(2025, 1, 1)
+    date.search.cache_clear()
+    assert date.first_date(text, None, ref) == datetime.datetime(2023, 3, 3)
+    # Without the internals of dateparser
+    monkeypatch.setattr(date, 'default_loader', None)
+    date.language.cache_clear()
+    try:
+        assert date.first_date(text, 'en', ref) == datetime.datetime(
+                2023, 3, 3)
+    finally:
+        date.language.cache_clear()
+    assert date.search.cache_info().currsize == 0
@@ -0,0 +1,136 @@
+import papier
+import papier.document
+import os
+import pathlib
+import pytest
+import random
+import re
+import shutil
+from pypdf import PdfWriter, PageObject
+from typing import Any
+
+
+def make_pdf(path: pathlib.Path) -> str:
+    writer = PdfWriter()
+    writer.add_blank_page(100, 100)
+    writer.add_metadata({'/Title': 'test'})
+    writer.write(path)
+    return str(path)
+
+
+def test_document_lazy(tmp_path: pathlib.Path) -> None:
+    """test that nothing is parsed until the content is needed"""
+    doc = papier.Document.from_import(make_pdf(tmp_path / 'a.pdf'), 'no')
+    assert doc.sha256sum() != ''
+    assert doc.pdfreader_ is None
+    assert doc.tmpfile_ == ''
+    assert doc.pdfreader.metadata['/Title'] == 'test'
+    assert doc.tmpfile_ != ''
+
+
+def test_document_pages(tmp_path: pathlib.Path) -> None:
+    """test that page texts are only extracted when needed"""
+    doc = papier.Document.from_import(make_pdf(tmp_path / 'a.pdf'), 'no')
+    assert len(doc.pages) == 1
+    assert doc.pages[0].raw_ is None
+    assert doc.text == ''
+    assert doc.pages[0].raw_ == ''
+
+
+def test_document_single_pass(tmp_path: pathlib.Path,
+                              monkeypatch: pytest.MonkeyPatch) -> None:
+    """test that each page is parsed once for the text and the parts"""
+    calls = []
+    extract_text = PageObject.extract_text
+
+    def counting(*args: Any, **kwds: Any) -> str:
+        calls.append(args)
+        return extract_text(*args, **kwds)
+
+    monkeypatch.setattr(PageObject, 'extract_text', counting)
+    doc = papier.Document.from_import(make_pdf(tmp_path / 'a.pdf'), 'no')
+    doc.text
+    doc.important_parts()
+    doc.important_parts()
+    assert len(calls) == 1
+
+
+def reference_normalized(text: str) -> str:
+    """Quadratic implementation normalized() must stay equivalent to"""
+    res = ''
+    lines = text.split('\n')
+    for line in lines:
+        line = line.strip()
+        if not line:
+            line = '\n'
+        else:
+            line = re.sub(r'\s+', ' ', line)
+            if not re.search(r'[\w\d,\-]', line[-1]):
+                line += '\n'
+            else:
+                line += ' '
+        res += line
+    res = res.strip()
+    return res
+
+
+def test_normalized() -> None:
+    """test normalized() against the reference, on whole texts and on
+    chunks"""
+    rng = random.Random(0)
+    alphabet = ['a', 'Z', '9', ',', '-', '.', ':', ' ', '\t', '\n', '\n',
+                '\r', '\x0c', '\xa0', ' ', 'é', '_', '€']
+    for _ in range(2000):
+        text = ''.join(rng.choice(alphabet)
+                       for _ in range(rng.randint(0, 40)))
+        expected = reference_normalized(text)
+        assert papier.document.normalized(text) == expected
+        cuts = sorted(rng.randint(0, len(text)) for _ in range(3))
+        chunks = [text[i:j] for i, j in zip([0] + cuts, cuts + [None])]
+        assert papier.document.normalized(iter(chunks)) == expected
+
+
+def test_document_close(tmp_path: pathlib.Path) -> None:
+    """test that closing a document releases its content and its
+    temporary file"""
+    pdf = make_pdf(tmp_path / 'a.pdf')
+    tmpfile = str(tmp_path / 'tmp.pdf')
+    shutil.copy(pdf, tmpfile)
+    with papier.Document.from_tmpfile(pdf, tmpfile) as doc:
+        assert doc.text == ''
+        assert doc.mmap_ is not None
+    assert not os.path.exists(tmpfile)
+    assert doc.pdfreader_ is None and doc.text_ is None
+    assert not hasattr(doc, '__dict__')
+
+    # Without OCR, the original file is read directly, and is kept even
+    # if the document is moved (as organize does)
+    with papier.Document.from_import(pdf, 'no') as doc:
+        assert doc.tmpfile == pdf
+        assert not doc.owns_tmpfile()
+        doc.path = str(tmp_path / 'elsewhere.pdf')
+    assert os.path.exists(pdf)
+
+    handle = papier.Document.from_library(str(tmp_path / 'missing.pdf'),
+                                          'f' * 64, 1.0)
+    assert handle.sha256sum() == 'f' * 64
+    assert handle.mtime() == 1.0
+
+
+def test_document_view(tmp_path: pathlib.Path) -> None:
+    """test that views only expose what their budget allows"""
+    assert papier.document.sampled('abcdef', 2, 1) == 'ab\nf'
+    assert papier.document.sampled('abcdef', 2) == 'ab'
+    assert papier.document.sampled('abcdef', 4, 2) == 'abcdef'
+
+    writer = PdfWriter()
+    for _ in range(3):
+        writer.add_blank_page(100, 100)
+    writer.write(tmp_path / 'a.pdf')
+    doc = papier.Document.from_import(str(tmp_path / 'a.pdf'), 'no')
+    view = papier.document.View(doc, papier.Budget(pages=2, chars=10))
+    assert len(view.pages) == 2
+    assert view.text == ''
+    assert view.important_parts() == []
+    assert view.sha256sum() == doc.sha256sum()
+    assert view.path == doc.path
@@ -0,0 +1,78 @@
+import papier
+import papier.models
+import pytest
+from types import SimpleNamespace
+from papier.plugin import emmitter
+from papier.plugin.emmitter import windows, within_part
+
+
+def test_windows() -> None:
+    """test that parts are packed in order into windows of at most size
+    characters, within the limits on the parts and their length"""
+    parts = ['aaaa', 'bb', 'cccccc', 'd', 'eeeeeeeeee']
+    assert windows(parts, 0, 0, 0) == [parts]
+    # 'aaaa\nbb' and 'cccccc\nd' fit, the last part is cut
+    assert windows(parts, 8, 0, 0) == [
+            ['aaaa', 'bb'], ['cccccc', 'd'], ['eeeeeeee']]
+    # Each window holds at most size characters, once joined
+    for size in range(1, 12):
+        assert all(len('\n'.join(w)) <= size
+                   for w in windows(parts, size, 0, 0))
+    assert windows(parts, 0, 2, 0) == [['aaaa', 'bb']]
+    assert windows(parts, 0, 0, 9) == [['aaaa', 'bb', 'ccc']]
+    assert windows(parts, 6, 3, 9) == [['aaaa'], ['bb', 'ccc']]
+    assert windows([], 8, 0, 0) == []
+
+
+def test_within_part() -> None:
+    """test that spans are mapped back to the parts of a window"""
+    parts = ['ACME', 'Invoice']
+    text = '\n'.join(parts)
+    assert within_part(parts, 0, 4)
+    assert within_part(parts, text.index('Invoice'), len(text))
+    assert not within_part(parts, 2, 7)
+    assert not within_part(parts, len(text), len(text) + 1)
+
+
+class NLP():
+    """Finds the companies it knows in the texts, as gliner would"""
+
+    def __init__(self: 'NLP', companies: list[str]) -> None:
+        self.companies = companies
+        self.batches = []
+
+    def pipe(self: 'NLP', texts: list, as_tuples: bool, **kwargs: dict
+             ) -> list:
+        self.batches.append([text for text, _ in texts])
+        res = []
+        for text, context in texts:
+            ents = [SimpleNamespace(label_='company', text=name,
+                                    start_char=text.index(name),
+                                    end_char=text.index(name) + len(name))
+                    for name in self.companies if name in text]
+            res.append((SimpleNamespace(ents=ents), context))
+        return res
+
+
+def test_extract_emmitter(monkeypatch: pytest.MonkeyPatch) -> None:
+    """test that each round only runs the next window of the documents
+    without a company yet, and that entities spanning two parts are
+    ignored"""
+    nlp = NLP(['ACME', 'Bank', 'Foo\nBar'])
+    monkeypatch.setattr(papier.models, 'get', lambda *args: nlp)
+    monkeypatch.setitem(emmitter.gliner_config, 'chunk_size', 12)
+
+    def document(parts: list[str]) -> SimpleNamespace:
+        return SimpleNamespace(important_parts=lambda: parts)
+
+    pairs = [(document(['ACME', 'Invoice']), {'lang': 'en'}),
+             (document(['Statement', 'of', 'the', 'Bank']), {'lang': 'en'}),
+             (document(['Foo', 'Bar']), {'lang': 'en'}),
+             (document(['ACME']), {})]
+    extract = next(e.extract for e in papier.extractor._registered
+                   if e.plugin == 'emmitter')
+    assert extract(pairs) == [
+            ({'emmitter': 'ACME'}, {}), ({'emmitter': 'Bank'}, {}),
+            ({'emmitter': ''}, {}), ({}, {})]
+    assert nlp.batches == [['ACME\nInvoice', 'Statement\nof', 'Foo\nBar'],
+                           ['the\nBank']]
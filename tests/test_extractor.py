@@ -1,6 +1,7 @@
 import pytest
+import threading
 import papier
-from typing import Dict, Any
+from typing import Dict, Any, Callable
 
 
 def test_extractors() -> None:
@@ -19,3 +20,92 @@ def test_extractors_same_tag() -> None:
         @papier.extracts(produces=['foo'])
         def bar() -> Dict[str, Any]:
             return {}
+
+
+def test_extractor_batch() -> None:
+    """test that single and batch extractors are called the same way"""
+    def single(document: Any, tags: Dict[str, Any]) -> tuple:
+        return {'n': document}, {}
+
+    def batch(pairs: list) -> list:
+        return [({'n': document}, {}) for document, _ in pairs]
+
+    for e in (papier.extractor.Extractor(single, [], ['n']),
+              papier.extractor.Extractor(batch, [], ['n'], batch=True)):
+        assert e.extract_one(1, {}) == ({'n': 1}, {})
+        assert e.extract_many([(1, {}), (2, {})]) == [({'n': 1}, {}),
+                                                      ({'n': 2}, {})]
+
+
+def extractor(name: str, consumes: list[str], produces: list[str]
+              ) -> papier.extractor.Extractor:
+    def extract(document: Any, tags: Dict[str, Any]) -> tuple:
+        return {tag: name for tag in produces}, {}
+    extract.__module__ = f'papier.plugin.{name}'
+    return papier.extractor.Extractor(extract, consumes, produces)
+
+
+def test_extractor_order() -> None:
+    """test that extractors come after the producers of their inputs"""
+    date = extractor('date', ['lang'], ['date'])
+    lang = extractor('lang', [], ['lang'])
+    name = extractor('name', ['date', 'lang'], ['name'])
+    other = extractor('other', [], ['other'])
+    res, left = papier.extractor.ordered([name, date, lang, other])
+    assert res == [lang, date, name, other]
+    assert left == []
+
+
+def test_extractor_cycle() -> None:
+    """test that extractors depending on each other are reported"""
+    a = extractor('a', ['b'], ['a'])
+    b = extractor('b', ['a'], ['b'])
+    c = extractor('c', [], ['c'])
+    with pytest.raises(papier.PluginError, match='a, b'):
+        papier.extractor.check([a, b, c])
+    papier.extractor.check([c, extractor('d', ['c', 'd'], ['d'])])
+
+
+def test_extractor_run() -> None:
+    """test that extractors run concurrently, once their inputs are
+    known"""
+    lang = extractor('lang', [], ['lang'])
+    read = extractor('read', [], ['read'])
+    date = extractor('date', ['lang'], ['date'])
+    name = extractor('name', ['lang'], ['name'])
+    # Fails unless the extractors run 2 by 2
+    barrier = threading.Barrier(2, timeout=5)
+    tags = {}
+
+    def start(e: papier.extractor.Extractor) -> Callable:
+        known = dict(tags)
+
+        def run() -> tuple:
+            assert set(e.consumes) <= set(known)
+            barrier.wait()
+            return e.extract_one(None, known)
+        return run
+
+    done = []
+    for e, (sure, _) in papier.extractor.run([lang, read, date, name],
+                                             start, threads=2):
+        done.append(e.plugin)
+        tags |= sure
+    assert set(done[:2]) == {'lang', 'read'}
+    assert set(done[2:]) == {'date', 'name'}
+    assert tags == {'lang': 'lang', 'read': 'read', 'date': 'date',
+                    'name': 'name'}
+
+
+def test_extractor_needed() -> None:
+    """test that only the extractors producing the needed tags, and
+    their inputs, are selected"""
+    read = extractor('read', [], [])
+    lang = extractor('lang', [], ['lang'])
+    date = extractor('date', ['lang'], ['date'])
+    name = extractor('name', ['lang'], ['name'])
+    extractors = [read, lang, date, name]
+    assert papier.extractor.needed(extractors, ['date']) == [read, lang,
+                                                             date]
+    assert papier.extractor.needed(extractors, ['lang']) == [read, lang]
+    assert papier.extractor.needed(extractors, []) == [read]
@@ -0,0 +1,17 @@
+import pathlib
+import os
+import papier.files
+
+
+def test_clone(tmp_path: pathlib.Path) -> None:
+    """test that clones have the content of the source, and only share
+    its inode when linking is allowed"""
+    src = tmp_path / 'src'
+    src.write_bytes(b'x' * 100000)
+    papier.files.clone(str(src), str(tmp_path / 'copy'))
+    assert (tmp_path / 'copy').read_bytes() == src.read_bytes()
+    assert not os.path.samefile(src, tmp_path / 'copy')
+
+    papier.files.clone(str(src), str(tmp_path / 'link'), link=True)
+    assert (tmp_path / 'link').read_bytes() == src.read_bytes()
+    assert os.path.samefile(src, tmp_path / 'link')
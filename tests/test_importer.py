@@ -0,0 +1,144 @@
+import confuse
+import pathlib
+import os
+import pytest
+import papier
+import papier.library
+from papier.extractor import Extractor
+from papier.library import Library
+from typing import Callable
+from papier.plugin.importer import (find_pdfs, extract_cached, merge, final,
+                                    store, discard)
+
+
+def test_find_pdfs(tmp_path: pathlib.Path) -> None:
+    """test that unchanged directories are only searched for
+    subdirectories"""
+    (tmp_path / 'a' / 'b').mkdir(parents=True)
+    for name in ('x.pdf', 'a/y.PDF', 'a/b/z.pdf', 'a/notes.txt'):
+        (tmp_path / name).touch()
+
+    seen = dict()
+    found = set(find_pdfs(str(tmp_path), {}, seen))
+    assert found == {str(tmp_path / name)
+                     for name in ('x.pdf', 'a/y.PDF', 'a/b/z.pdf')}
+    assert len(seen) == 3
+
+    # A new file in a/b changes the watermark of a/b only
+    (tmp_path / 'a' / 'b' / 'new.pdf').touch()
+    st = os.stat(tmp_path / 'a' / 'b')
+    os.utime(tmp_path / 'a' / 'b',
+             ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    found = set(find_pdfs(str(tmp_path), seen))
+    assert found == {str(tmp_path / 'a' / 'b' / name)
+                     for name in ('z.pdf', 'new.pdf')}
+
+    pdf = str(tmp_path / 'x.pdf')
+    assert list(find_pdfs(pdf)) == [pdf]
+
+
+def test_extract_cached(monkeypatch: pytest.MonkeyPatch, library: Library,
+                        make_docs: Callable,
+                        config: confuse.Configuration) -> None:
+    """test that extractors only run again when their inputs change, and
+    that nothing is cached on dry runs"""
+    monkeypatch.setattr(papier.library, '_library', library)
+    config['dry_run'] = False
+    calls = []
+
+    def extract(document: papier.Document, tags: dict) -> tuple:
+        calls.append(tags['lang'])
+        return {'n': tags['lang']}, {}
+
+    e = Extractor(extract, ['lang'], ['n'])
+    doc, = make_docs(1)
+    for lang in ('en', 'en', 'fr', 'fr'):
+        assert extract_cached(e, [(doc, {'lang': lang})]) == [
+                ({'n': lang}, {}, {})]
+    assert calls == ['en', 'fr']
+
+    config['dry_run'] = True
+    for lang in ('de', 'de'):
+        extract_cached(e, [(doc, {'lang': lang})])
+    assert calls == ['en', 'fr', 'de', 'de']
+
+
+def test_store(monkeypatch: pytest.MonkeyPatch, library: Library,
+               make_docs: Callable, config: confuse.Configuration) -> None:
+    """test that the library is not locked while the documents are
+    handled, and that the ones handled before a failure are stored"""
+    monkeypatch.setattr(papier.library, '_library', library)
+    config['dry_run'] = False
+    docs = make_docs(3)
+
+    handled = []
+
+    def send_event(event: str, doc: papier.Document, tags: dict) -> None:
+        handled.append(library.connection().in_transaction)
+        if doc is docs[1]:
+            raise OSError('copy failed')
+
+    monkeypatch.setattr(papier, 'send_event', send_event)
+    with pytest.raises(OSError):
+        store([(doc, {'n': i}) for i, doc in enumerate(docs)])
+    assert handled == [False, False]
+    assert [tags for doc, tags in library.list()] == ['{"n": 0}']
+
+
+def test_discard(tmp_path: pathlib.Path) -> None:
+    """test that the items dropped by the import stages have their
+    temporary files deleted, and never the files to import"""
+    pdf, tmpfile = tmp_path / 'a.pdf', tmp_path / 'ocred.pdf'
+    pdf.touch()
+    tmpfile.touch()
+    dropped = set()
+    discard((str(pdf), '0' * 64, str(tmpfile), []), dropped)
+    discard((str(pdf), '0' * 64, str(pdf), []), dropped)
+    discard((str(pdf), '0' * 64), dropped)
+    assert not tmpfile.exists() and pdf.exists()
+    assert dropped == {str(pdf)}
+
+
+def test_merge_confidence() -> None:
+    """test that final values are kept, and make their producers skip"""
+    def extract(document: papier.Document, tags: dict) -> tuple:
+        return {}, {}
+
+    def read(document: papier.Document, tags: dict) -> tuple:
+        return {}, {}
+
+    e = Extractor(extract, [], ['date'])
+    meta = Extractor(read, [], [])
+    tags, choices, confidences = {}, {}, {}
+    merge(e, {'date': '2020-01-01'}, {}, {}, tags, choices, confidences)
+    assert not final(e, tags, confidences, {meta.name})
+    merge(meta, {'date': '2021-01-01'}, {}, {'date': 1.0}, tags, choices,
+          confidences)
+    assert tags == {'date': '2021-01-01'}
+    assert final(e, tags, confidences, {meta.name})
+    # meta may not be done when e starts, unless e depends on it
+    assert not final(e, tags, confidences, set())
+    merge(e, {'date': '2022-01-01'}, {}, {'date': 0.95}, tags, choices,
+          confidences)
+    assert tags == {'date': '2021-01-01'}
+
+
+def test_merge_order(config: confuse.Configuration) -> None:
+    """test that conflicts between final values do not depend on the
+    order of the merges"""
+    def extract(document: papier.Document, tags: dict) -> tuple:
+        return {}, {}
+
+    first, second = (Extractor(extract, [], ['n']) for i in range(2))
+    first.plugin, second.plugin = 'first', 'second'
+    config['autotag']['priority']['n'] = 'second'
+    for confidence, winner in ((0.95, 1), (0.99, 2), (0.97, 2)):
+        results = [
+            (first, {'n': 1}, {'n': 0.97}),
+            (second, {'n': 2}, {'n': confidence})]
+        for order in (results, results[::-1]):
+            tags, choices, confidences = {}, {}, {}
+            for e, sure, confidence_ in order:
+                merge(e, dict(sure), {}, dict(confidence_), tags, choices,
+                      confidences)
+            assert tags == {'n': winner}
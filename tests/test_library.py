@@ -0,0 +1,166 @@
+import json
+import pathlib
+import sqlite3
+import threading
+import pytest
+from typing import Callable
+import papier
+import papier.library
+from papier.library import Library
+# The plugins declaring the events organize handles come first
+import papier.plugin.importer  # noqa: F401
+from papier.plugin.organize import parse_where
+
+
+def test_library_transaction(library: Library, make_docs: Callable
+                             ) -> None:
+    """test that transactions commit once, and roll back on errors"""
+    doc, = make_docs(1)
+    with library.transaction():
+        with library.transaction():
+            library.add(doc, {'a': 1})
+        # Other threads see the changes once the outermost block ends
+        seen = []
+        reader = threading.Thread(target=lambda: seen.append(
+                library.has(doc)))
+        reader.start()
+        reader.join()
+        assert seen == [False]
+    assert library.has(doc)
+
+    with pytest.raises(ValueError):
+        with library.transaction():
+            library.delete(doc)
+            raise ValueError()
+    assert library.has(doc)
+
+
+def test_library_upsert_many(tmp_path: pathlib.Path, library: Library,
+                             make_docs: Callable) -> None:
+    """test that documents are inserted, then updated, in bulk"""
+    docs = make_docs(3)
+    library.add_many((doc, {'n': i}) for i, doc in enumerate(docs))
+    docs[0].path = str(tmp_path / 'moved.pdf')
+    (tmp_path / 'moved.pdf').touch()
+    library.upsert_many([(docs[0], {'n': 10})])
+    assert sorted((doc.path, tags) for doc, tags in library.list()) == [
+            (docs[1].path, '{"n": 1}'), (docs[2].path, '{"n": 2}'),
+            (str(tmp_path / 'moved.pdf'), '{"n": 10}')]
+
+
+def test_library_migrations(tmp_path: pathlib.Path) -> None:
+    """test that unversioned databases are migrated, and that looking
+    documents up by path uses an index"""
+    path = str(tmp_path / 'library.sqlite')
+    with sqlite3.connect(path) as conn:
+        conn.execute('CREATE TABLE library(sha256sum PRIMARY KEY, '
+                     'path TEXT, mtime REAL, text TEXT, tags TEXT)')
+        conn.execute("INSERT INTO library VALUES('0', 'a.pdf', 1, '', '{}')")
+    library = Library(path)
+    library.init()
+    conn = library.connection()
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    assert version == len(papier.library.MIGRATIONS)
+    assert conn.execute('SELECT size FROM library').fetchall() == [(None,)]
+    plan = conn.execute('EXPLAIN QUERY PLAN SELECT 1 FROM library '
+                        'WHERE path = ? and mtime = ? and size = ?',
+                        ('a.pdf', 1, 0)).fetchall()
+    assert 'USING INDEX' in plan[0][-1]
+    # Opening again is a no-op
+    library.init()
+    library.close()
+
+    with sqlite3.connect(path) as conn:
+        conn.execute(f'PRAGMA user_version = {version + 1}')
+    with pytest.raises(papier.PapierError):
+        Library(path).init()
+
+
+def test_library_search(library: Library, make_docs: Callable) -> None:
+    """test that the full-text index follows the library"""
+    texts = ['Invoice from ACME, total 12 EUR',
+             'Électricité: facture de mars',
+             'Bank statement, ACME account']
+    docs = [(doc, {'n': str(i)})
+            for i, doc in enumerate(make_docs(3, texts))]
+    docs[0][1]['total'] = 12
+    library.add_many(docs)
+
+    def found(query: str, tags: dict = {}) -> list[str]:
+        return [json.loads(tags)['n']
+                for _, tags, _ in library.search(query, tags)]
+
+    assert sorted(found('acme')) == ['0', '2']
+    assert found('acme', {'n': '2'}) == ['2']
+    # Tags given as text still match numbers
+    assert found('acme', {'total': '12'}) == ['0']
+    assert found('electricite') == ['1']
+    _, _, snippet = library.search('invoice')[0]
+    assert '[Invoice]' in snippet
+
+    docs[0][0].text_ = 'Receipt'
+    library.upsert_many([docs[0]])
+    library.delete(docs[2][0])
+    assert found('acme') == []
+    assert found('receipt') == ['0']
+    with pytest.raises(papier.CommandError):
+        library.search('"unbalanced')
+
+
+def test_library_vacuum(library: Library, make_docs: Callable) -> None:
+    """test that the full-text index still matches the documents once
+    the database is vacuumed"""
+    texts = ['zero', 'one', 'two', 'three']
+    docs = [(doc, {'n': i}) for i, doc in enumerate(make_docs(4, texts))]
+    library.add_many(docs)
+    library.delete(docs[1][0])
+    conn = library.connection()
+    columns = conn.execute('PRAGMA table_info(library)').fetchall()
+    assert ('id', 'INTEGER') in [(c[1], c[2]) for c in columns if c[5]]
+    conn.execute('VACUUM')
+    for i, text in [(0, 'zero'), (2, 'two'), (3, 'three')]:
+        assert [json.loads(tags)['n']
+                for _, tags, _ in library.search(text)] == [i]
+    assert library.search('one') == []
+
+
+def test_library_tags(library: Library, make_docs: Callable) -> None:
+    """test that documents are filtered by tag in SQL, comparing values
+    of the same type"""
+    tags = [('acme', '2022-12-31'), ('acme', '2023-03-01'),
+            ('bank', '2023-06-01')]
+    docs = [(doc, {'emmitter': emmitter, 'date': date, 'n': i})
+            for i, (doc, (emmitter, date)) in enumerate(zip(make_docs(3),
+                                                            tags))]
+    docs[0][1]['invoice'], docs[1][1]['invoice'] = '42', 42
+    library.add_many(docs)
+
+    def listed(*conditions: tuple) -> list[int]:
+        return sorted(json.loads(tags)['n']
+                      for _, tags in library.list(conditions))
+
+    assert listed() == [0, 1, 2]
+    assert listed(('emmitter', '=', 'acme')) == [0, 1]
+    assert listed(('emmitter', '=', 'acme'),
+                  ('date', '>=', '2023-01-01')) == [1]
+    assert listed(('emmitter', '!=', 'acme')) == [2]
+    assert listed(('n', '>', 0)) == [1, 2]
+    # As given on the command line
+    assert listed(parse_where('n>0')) == [1, 2]
+    assert listed(parse_where('n <= 1.5')) == [0, 1]
+    assert listed(parse_where('date<2023-01-01')) == [0]
+    assert listed(parse_where('invoice=42')) == [0, 1]
+    assert listed(('invoice', '=', 42)) == [1]
+    assert listed(parse_where('invoice!=42')) == []
+    # Text is not greater than every number
+    assert listed(parse_where('date>=9999')) == []
+    assert listed(parse_where('invoice>=9999')) == []
+    with pytest.raises(papier.CommandError):
+        listed(('n', 'LIKE', 0))
+
+    docs[2][1]['emmitter'] = 'acme'
+    library.upsert_many([docs[2]])
+    library.delete(docs[0][0])
+    assert listed(('emmitter', '=', 'acme')) == [1, 2]
+    count = library.connection().execute('SELECT COUNT(*) FROM tags')
+    assert count.fetchone()[0] == 7
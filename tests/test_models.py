@@ -0,0 +1,54 @@
+import confuse
+import papier
+import papier.models
+import pytest
+import itertools
+
+
+def test_models(monkeypatch: pytest.MonkeyPatch,
+                config: confuse.Configuration) -> None:
+    """test that models are loaded once, and that the least recently used
+    ones are dropped when over budget"""
+    papier.models.clear()
+    config['models']['memory'].set(2)
+    # Every model takes 1MB
+    counter = itertools.count()
+    monkeypatch.setattr(papier.models, 'rss',
+                        lambda: next(counter) * 1024 * 1024)
+
+    loads = []
+
+    def factory(name: str) -> object:
+        loads.append(name)
+        return object()
+
+    a = papier.models.get(lambda: factory('a'), 'a')
+    assert papier.models.get(lambda: factory('a'), 'a') is a
+    papier.models.get(lambda: factory('b'), 'b', 'en')
+    papier.models.get(lambda: factory('a'), 'a')
+    papier.models.get(lambda: factory('c'), 'c', config={'x': 1})
+    # b was the least recently used
+    papier.models.get(lambda: factory('a'), 'a')
+    papier.models.get(lambda: factory('b'), 'b', 'en')
+    assert loads == ['a', 'b', 'c', 'b']
+    papier.models.clear()
+
+
+def test_models_size(monkeypatch: pytest.MonkeyPatch,
+                     config: confuse.Configuration) -> None:
+    """test that the size given for a model is used instead of the growth
+    of the resident memory"""
+    papier.models.clear()
+    config['models']['memory'].set(3)
+    # Other threads allocate meanwhile
+    counter = itertools.count()
+    monkeypatch.setattr(papier.models, 'rss',
+                        lambda: next(counter) * 100 * 1024 * 1024)
+
+    a = papier.models.get(object, 'a', size=1)
+    papier.models.get(object, 'b', size=2)
+    assert papier.models.get(object, 'a') is a
+    papier.models.get(object, 'c')
+    # c seems to take 100MB: only c is kept
+    assert list(papier.models._models) == [papier.models.key('c')]
+    papier.models.clear()
@@ -0,0 +1,31 @@
+import confuse
+import papier.ocrcache as ocrcache
+import pathlib
+import os
+
+
+def test_ocrcache(tmp_path: pathlib.Path,
+                  config: confuse.Configuration) -> None:
+    """test that entries can be retrieved, and that the least recently
+    used ones are evicted first"""
+    config['ocr_cache'].set({'directory': str(tmp_path / 'cache'),
+                             'max_size': 1})
+    assert ocrcache.key('0' * 64, 'no') is None
+    keys = [ocrcache.key(str(i) * 64, 'yes') for i in range(3)]
+    assert keys[0] != ocrcache.key('0' * 64, 'force')
+
+    pdf = tmp_path / 'a.pdf'
+    pdf.write_bytes(b'x' * 300 * 1024)
+    for i, key in enumerate(keys):
+        ocrcache.put(key, str(pdf))
+        ocrcache.put_pages(key, [(f'text {i}', [])])
+        # make sure the entries have distinct access times
+        for ext in ('pdf', 'json'):
+            os.utime(ocrcache._path(key, ext), (i, i))
+    assert ocrcache.get_pages(keys[0]) == [['text 0', []]]
+    assert ocrcache.get(keys[0]) is not None
+
+    # Exceed the maximal size
+    ocrcache.put('3' * 64, str(pdf))
+    assert ocrcache.get(keys[0]) is not None
+    assert ocrcache.get(keys[1]) is None
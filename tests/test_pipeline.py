@@ -0,0 +1,118 @@
+import pytest
+import threading
+import time
+from papier.pipeline import Pipeline, Stage
+
+
+def test_pipeline() -> None:
+    """test that every item goes through every stage, and that items
+    mapped to None are dropped"""
+    results = []
+    lock = threading.Lock()
+
+    def collect(x: int) -> None:
+        with lock:
+            results.append(x)
+
+    stages = [
+        Stage('double', lambda x: 2 * x, workers=3),
+        Stage('odd', lambda x: x if x % 4 else None, workers=2),
+        Stage('collect', collect),
+        ]
+    Pipeline(stages, queue_size=2).run(range(100))
+    assert sorted(results) == [x for x in range(2, 200, 4)]
+
+
+def test_pipeline_error() -> None:
+    """test that an error in a stage stops the pipeline and is raised"""
+    def fail(x: int) -> int:
+        if x == 10:
+            raise ValueError(x)
+        return x
+
+    stages = [Stage('fail', fail, workers=2), Stage('noop', lambda x: x)]
+    with pytest.raises(ValueError):
+        Pipeline(stages, queue_size=1).run(range(1000))
+
+
+def test_pipeline_batch() -> None:
+    """test that batch stages get lists of at most batch_size items"""
+    sizes = []
+    results = []
+
+    def square(batch: list[int]) -> list[int]:
+        sizes.append(len(batch))
+        return [x * x for x in batch]
+
+    stages = [
+        Stage('square', square, batch_size=4, batch_wait=0.01),
+        Stage('collect', results.append),
+        ]
+    Pipeline(stages).run(range(10))
+    assert sorted(results) == [x * x for x in range(10)]
+    assert max(sizes) <= 4 and sum(sizes) == 10
+
+
+def test_pipeline_item_errors() -> None:
+    """test that the items a stage fails on are dropped, and released,
+    while the others reach the last stage"""
+    results, discarded = [], []
+    lock = threading.Lock()
+
+    def fail(batch: list[int]) -> list[int]:
+        if 10 in batch:
+            raise ValueError(10)
+        return batch
+
+    def collect(x: int) -> None:
+        with lock:
+            results.append(x)
+
+    stages = [
+        Stage('fail', fail, workers=2, batch_size=4, batch_wait=0.01,
+              errors=(ValueError,), discard=discarded.append),
+        Stage('collect', collect),
+        ]
+    Pipeline(stages, queue_size=2).run(range(30))
+    assert sorted(results) == [x for x in range(30) if x != 10]
+    assert discarded == [10]
+
+    # Unless the error is fatal
+    stages[0].fatal = (ValueError,)
+    with pytest.raises(ValueError):
+        Pipeline(stages, queue_size=2).run(range(30))
+
+
+def test_pipeline_abort() -> None:
+    """test that once the pipeline stops, the stages which drain still
+    process the items left, and that the others release them"""
+    stored, discarded = [], []
+    lock = threading.Lock()
+
+    def fail(x: int) -> int:
+        if x == 50:
+            raise RuntimeError(x)
+        return x
+
+    def slow(x: int) -> int:
+        time.sleep(0.001)
+        return x
+
+    def store(batch: list[int]) -> list[None]:
+        with lock:
+            stored.extend(batch)
+        return [None for x in batch]
+
+    def discard(x: int) -> None:
+        with lock:
+            discarded.append(x)
+
+    stages = [
+        Stage('fail', fail),
+        Stage('slow', slow, workers=2, discard=discard),
+        Stage('store', store, batch_size=64, batch_wait=10, drain=True),
+        ]
+    with pytest.raises(RuntimeError):
+        Pipeline(stages, queue_size=4).run(range(100))
+    assert sorted(stored + discarded) == list(range(50))
+    assert stored
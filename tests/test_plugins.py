@@ -0,0 +1,99 @@
+import confuse
+import papier
+import papier.cli.commands
+import papier.plugin
+import papier.plugins
+import pathlib
+import pytest
+import sys
+
+
+PLUGIN = '''import papier
+from papier.cli.commands import command
+
+
+@command()
+def manifest_test(args: list) -> None:
+    """test command"""
+'''
+
+
+DECLARER = '''import papier
+
+papier.declare_event('declared_test', 'test event', __name__)
+'''
+
+
+HANDLER = '''import papier
+
+
+def on_declared_test() -> None:
+    pass
+
+
+papier.set_event_handler('declared_test', on_declared_test)
+'''
+
+
+@pytest.fixture
+def plugin_directory(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch,
+                     config: confuse.Configuration) -> pathlib.Path:
+    """tmp_path, where plugins are looked for too, and their manifest is
+    cached, until the end of the test"""
+    monkeypatch.setattr(papier.plugin, '__path__',
+                        [*papier.plugin.__path__, str(tmp_path)])
+    config['plugin_manifest'].set(str(tmp_path / 'manifest.json'))
+    return tmp_path
+
+
+def forget(plugin: str) -> None:
+    """Forget about the plugin, as a new process would"""
+    sys.modules.pop(f'papier.plugin.{plugin}', None)
+    papier.plugins._available.remove(plugin)
+    papier.plugins._loaded.discard(plugin)
+    del papier.plugins._manifest[plugin]
+
+
+def test_manifest(plugin_directory: pathlib.Path) -> None:
+    """test that once in the manifest, a plugin is known without being
+    imported"""
+    (plugin_directory / 'manifest_test.py').write_text(PLUGIN)
+    modname = 'papier.plugin.manifest_test'
+
+    papier.plugins.scan_plugins(['manifest_test'])
+    assert modname in sys.modules
+    assert (plugin_directory / 'manifest.json').exists()
+
+    # Start over, as a new process would
+    forget('manifest_test')
+    del papier.cli.commands._command_module['manifest_test']
+
+    papier.plugins.scan_plugins(['manifest_test'])
+    assert modname not in sys.modules
+    assert ('manifest_test', 'manifest_test', 'test command') in \
+        papier.plugins.commands()
+    papier.plugins.load_plugin('manifest_test')
+    assert modname in sys.modules
+
+
+def test_manifest_events(plugin_directory: pathlib.Path) -> None:
+    """test that a plugin handling an event imports the plugin declaring
+    it, even when only the handler changed since the manifest was
+    written"""
+    (plugin_directory / 'declarer_test.py').write_text(DECLARER)
+    (plugin_directory / 'handler_test.py').write_text(HANDLER)
+    papier.plugins.scan_plugins(['declarer_test', 'handler_test'])
+    assert papier.plugins.providers('events', 'declared_test') == [
+            'declarer_test']
+
+    # Start over, as a new process would, with a new handler
+    for plugin in ('declarer_test', 'handler_test'):
+        forget(plugin)
+    del papier.plugins._event_descriptions['declared_test']
+    papier.plugins._event_handlers.pop('declared_test')
+    (plugin_directory / 'handler_test.py').write_text(HANDLER + '# changed\n')
+
+    papier.plugins.scan_plugins(['declarer_test', 'handler_test'])
+    assert 'papier.plugin.declarer_test' in sys.modules
+    assert 'handler_test' in papier.plugins._available
+    assert papier.plugins._event_handlers['declared_test']
@@ -0,0 +1,32 @@
+import pathlib
+import pytest
+from papier.plugin.watch import Watcher
+
+
+def test_watcher_settle(tmp_path: pathlib.Path) -> None:
+    """test that files are ready once they stop changing, and only once"""
+    watcher = Watcher([str(tmp_path)], settle=0, interval=1, poll=True)
+    pdf = tmp_path / 'a.pdf'
+    pdf.write_bytes(b'%PDF')
+    watcher.rescan()
+    assert str(pdf) in watcher.pending
+
+    # Still being written
+    pdf.write_bytes(b'%PDF-1.7')
+    assert watcher.ready() == []
+    assert watcher.ready() == [str(pdf)]
+
+    watcher.rescan()
+    assert watcher.pending == {}
+
+
+def test_watcher_inotify(tmp_path: pathlib.Path) -> None:
+    """test that with inotify, the files are not remembered once ready"""
+    watcher = Watcher([str(tmp_path)], settle=0, interval=1)
+    if watcher.inotify is None:
+        pytest.skip('inotify is not available')
+    pdf = tmp_path / 'a.pdf'
+    pdf.write_bytes(b'%PDF')
+    watcher.rescan()
+    assert watcher.ready() == [str(pdf)]
+    assert watcher.seen == {}